@@ -1,83 +1,213 @@
 # core python imports
 import sys
+import time
 import argparse
+import tracemalloc
 
-# relative imports
-from src import apt_logger
-from src import read_xlsx as rx
-from src import AptSpec as apt
-from src import write_xlsx as wx
+STARTED = time.perf_counter()
+
+# exp_fit.LOSSES, repeated here so argument errors are reported without importing scipy
+LOSSES = ('linear', 'soft_l1', 'huber')
+
+# relative imports; numpy, scipy, xlrd & xlsxwriter are only imported on the code path that needs
+# them, so [-h] and argument errors return without loading them
+from src import timing
 
 
 def main():
     args = parse_args()
+
+    from src import apt_logger
+    log_file = args.log
+    if args.log_dir:
+        name = args.follow or (args.csv and args.csv[0]) or args.xlsx or ('batch' if args.batch else 'apt')
+        log_file = apt_logger.log_path(args.log_dir, name, args.log_json)
     log = apt_logger.init(
         debug=args.debug,
         file=args.debug_file,
         stream=args.debug_stream,
-        full=args.debug_all
+        full=args.debug_all,
+        log_file=log_file,
+        json_lines=args.log_json
     )
     log.debug('ARGS: {}'.format(args))
+    timing.timer.add('startup', time.perf_counter() - STARTED)
+    log.debug('startup: {:.3f}s'.format(time.perf_counter() - STARTED))
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if args.trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        run(args, log)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            import io
+            import pstats
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+            log.info('profile: cProfile stats written to "{}"'.format(args.profile))
+            log.debug('profile: top 15 by cumulative time\n{}'.format(stream.getvalue()))
+        if args.timing or args.profile or args.trace_memory:
+            timing.timer.log(log)
+        if args.timing:
+            timing.timer.write(args.timing, argv=sys.argv[1:], trace_memory=bool(args.trace_memory))
+            log.info('timing: summary written to "{}"'.format(args.timing))
+        if args.trace_memory:
+            tracemalloc.stop()
+
+
+def run(args, log):
+    """
+    read -> classify -> write, or one of the [-follow] / [-batch] modes
+    :param args: <Namespace> parsed CLI arguments
+    :param log: <Logger>
+    """
+    from src import data_cache
+    from src import trim as tr
+    from src import outliers as ol
+    from src import segment as sg
+    # the cache is opt-in: entries are never evicted, every edited input adds another copy of its columns
+    if args.no_cache:
+        args.cache_dir = None
+    elif args.cache and args.cache_dir is None:
+        args.cache_dir = data_cache.CACHE_DIR
+
+    try:
+        trim_rule = tr.from_args(args)
+    except ValueError as e:
+        log.error('--trim: {}'.format(e))
+        sys.exit(-1)
+    if trim_rule:
+        log.info('trim: {}'.format(trim_rule))
+    try:
+        outlier_rule = ol.from_args(args)
+    except ValueError as e:
+        log.error('--clean: {}'.format(e))
+        sys.exit(-1)
+    if outlier_rule:
+        log.info('clean: {}'.format(outlier_rule))
+    try:
+        segment_rule = sg.from_args(args)
+    except ValueError as e:
+        log.error('--segment: {}'.format(e))
+        sys.exit(-1)
+    if segment_rule:
+        log.info('segment: {}'.format(segment_rule))
 
     apt_specs = None
     order = None
     data = None
 
-    if not args.csv and not args.xlsx:
-        log.error('No input file defined')
-        sys.exit(-1)
+    if args.follow:
+        from src import follow as fw
+        try:
+            apt_specs, order = fw.follow(args.follow, log, interval=args.interval, start=int(args.start),
+                                         loss=args.loss, polls=args.polls, sidecar=args.sidecar,
+                                         outlier_rule=outlier_rule, segment_rule=segment_rule, end=args.end,
+                                         trim_rule=trim_rule)
+        except ValueError as e:
+            log.error('--trim: {}'.format(e))
+            sys.exit(-1)
+        if apt_specs:
+            # the latest fits take the same outlier report, bootstrap, sidecar & report steps as a single file
+            report(args, apt_specs, order, None, log)
+        return
+
+    if args.batch:
+        from src import batch
+        files = batch.find_inputs(args.batch)
+        if not files:
+            log.error('No *.csv or *.xlsx input files found for: "{}"'.format(args.batch))
+            sys.exit(-1)
+        results = batch.run_batch(files, args.out_dir, log, start=int(args.start), end=args.end,
+                                  workers=args.workers, constant_memory=args.constant_memory,
+                                  cache_dir=args.cache_dir, trim_rule=trim_rule, loss=args.loss,
+                                  outlier_rule=outlier_rule, segment_rule=segment_rule)
+        if any(status['status'] != 'ok' for status in results):
+            sys.exit(-1)
+        return
 
     if args.csv:
-        log.debug('CSV')
+        log.info('reading [csv] from path: "{}"'.format(args.csv[0]))
         log.debug('args.csv: {}'.format(args.csv[0]))
         log.debug('args.start: {}'.format(args.start))
         log.debug('args.end: {}'.format(args.end))
+        if len(args.csv) > 1:
+            log.warning('only the first *.csv is analyzed, ignoring: {}'.format(args.csv[1:]))
+        from src import read_csv as rc
+        with timing.stage('read'):
+            data, order = rc.read_csv(file=args.csv[0], start=int(args.start), log=log, end=args.end,
+                                      cache_dir=args.cache_dir)
 
     elif args.xlsx:
-        if args.xlsx.split('.')[-1] == 'xlsx':
-            log.info('reading [xlsx] from path: "{}"'.format(args.xlsx))
-            log.debug('args.xlsx: {}'.format(args.xlsx[0]))
-            log.debug('args.start: {}'.format(args.start))
-            log.debug('args.end: {}'.format(args.end))
-            if args.end:
-                data, order = rx.read_xlsx(file=args.xlsx, start=int(args.start), log=log, end=int(args.end))
-            else:
-                data, order = rx.read_xlsx(file=args.xlsx, start=int(args.start), log=log)
-        else:
-            log.error('Wrong file type, given: "{}", expected: "{}"'.format(args.xlsx.split('.')[-1], 'xlsx'))
-            sys.exit(-1)
+        log.info('reading [xlsx] from path: "{}"'.format(args.xlsx))
+        log.debug('args.xlsx: {}'.format(args.xlsx[0]))
+        log.debug('args.start: {}'.format(args.start))
+        log.debug('args.end: {}'.format(args.end))
+        from src import read_xlsx as rx
+        with timing.stage('read'):
+            data, order = rx.read_xlsx(file=args.xlsx, start=int(args.start), log=log, end=args.end,
+                                       cache_dir=args.cache_dir)
 
-        log.info('finished reading')
-        log.debug('spec order: {}'.format(order))
-        apt_specs = classify_data(data, log)
+    log.info('finished reading')
+    log.debug('spec order: {}'.format(order))
+    try:
+        with timing.stage('segment'):
+            trims = sg.windows(data, log, segment_rule, trim_rule)
+    except ValueError as e:
+        log.error('--trim: {}'.format(e))
+        sys.exit(-1)
+    from src import AptSpec as apt
+    with timing.stage('classify'):
+        apt_specs = apt.classify_data(data, log, trims, args.loss, outlier_rule)
+    report(args, apt_specs, order, data, log)
 
-    if args.trim:
-        log.debug('TRIM')
 
-    if apt_specs and order:
-        log.debug('-'*75)
-        # log.debug('apt_specs: {}'.format(apt_specs))
-        log.debug('-'*75)
-        wx.write_xlsx(apt_specs, order, data, log)
+def report(args, apt_specs, order, data, log):
+    """
+    Write every output of the fitted specs: the [-outlier_report], the [-bootstrap] intervals, the [-sidecar] & the
+    *.xlsx report.
 
+    :param args: <Namespace> parsed CLI arguments
+    :param apt_specs: <list> of fitted <AptSpec>
+    :param order: <list> of spec keys, in column order
+    :param data: <dict> of the AptSpec kwargs, None after [-follow]
+    :param log: <Logger>
+    """
+    if args.outlier_report:
+        from src import outliers as ol
+        ol.write_report(apt_specs, args.outlier_report, log)
 
-def classify_data(data, log):
-    log.info('-'*75)
-    specs = []
-    for i, key in enumerate(dict.keys(data)):
-        specs.append(apt.AptSpec(key, **data[key]))
+    bootstraps = None
+    if args.bootstrap:
+        log.info('bootstrap: {} refits per spec, seed: {}'.format(args.bootstrap, args.seed))
+        from src import bootstrap as bs
+        with timing.stage('bootstrap'):
+            bootstraps = bs.bootstrap_specs(apt_specs, args.bootstrap, seed=args.seed, workers=args.workers)
+        for spec, result in zip(apt_specs, bootstraps):
+            log.info('AptSpec: "{}" {}'.format(spec.name, result))
 
-    for spec in specs:
-        cf = spec.curve_fit()
-        popt = cf['popt']
-        pcov = cf['pcov']
-        if not all([v == 0 for v in popt]):
-            log.info('AptSpec: "{}" curve_fit successful'.format(spec.name))
-        else:
-            log.info('AptSpec: "{}" curve_fit failed'.format(spec.name))
-    log.info('-' * 75)
+    if args.sidecar:
+        log.info('writing sidecar: {}'.format(args.sidecar))
+        from src import write_sidecar as ws
+        with timing.stage('sidecar'):
+            ws.write_sidecar(apt_specs, args.sidecar, log, bootstraps)
 
-    return specs
+    if apt_specs and order and not args.no_report:
+        log.debug('-'*75)
+        # log.debug('apt_specs: {}'.format(apt_specs))
+        log.debug('-'*75)
+        log.info('writing report: {}'.format(args.output))
+        from src import write_xlsx as wx
+        with timing.stage('write'):
+            wx.write_xlsx(apt_specs, order, data, log, file=args.output, constant_memory=args.constant_memory)
 
 
 def parse_args():
@@ -89,9 +219,10 @@ def parse_args():
     analyze = 1
 
     trim_help = 'Toggle the trim function on. ' \
-                '\n Specify WHAT with [-N] names, or [-S] samples,' \
-                ' and WHERE with [-h] hours or [-n] number of samples'
+                '\n Specify WHAT with [-l] labels, or [-s] samples,' \
+                ' and WHERE with [-t] hours or [-n] number of samples, each as: start [end]'
     debug_help = 'Toggle debug to ON'
+    constant_memory_help = 'Stream the report to disk row by row, peak memory stays flat for very long tests'
 
     analyze_help = 'Specify what to analyze within the test results'
 
@@ -104,6 +235,41 @@ def parse_args():
     n_help = 'n: n samples for WHERE to [--trim]'
     xlsx_help = 'xlsx: raw *.xlsx test file'
     csv_help = 'csv: raw *.csv test file'
+    batch_help = 'batch: directory or glob of raw *.csv/*.xlsx test files to process in parallel'
+    out_dir_help = 'out_dir: directory for the [-batch] reports'
+    output_help = 'o: output *.xlsx report path for a single [-xlsx]/[-csv] file'
+    workers_help = 'workers: number of worker processes for [-batch] (default: the # of cores) & the ' \
+                   '[-bootstrap] refits (default: in-process)'
+    cache_help = 'Cache the parsed columns in .apt_cache, re-runs of an unchanged file skip parsing; ' \
+                 'entries are never evicted, delete the directory to reclaim the space'
+    cache_dir_help = 'cache_dir: directory of the [--cache], giving one turns the cache on (default: .apt_cache)'
+    no_cache_help = 'Always parse the raw file, neither reading nor writing the parsed-column cache'
+    follow_help = 'follow: live *.csv test export to tail, refitting as rows arrive; the report, ' \
+                  '[-outlier_report] & [-bootstrap] are written on Ctrl+C'
+    interval_help = 'interval: seconds between [-follow] polls'
+    polls_help = 'polls: stop [-follow] after this many polls, default runs until Ctrl+C'
+    sidecar_help = 'sidecar: *.json or *.csv of the fits & summary metrics, refreshed every [-follow] poll'
+    no_report_help = 'Skip the *.xlsx report, e.g. when only the [-sidecar] is needed'
+    log_help = 'log: path of the log file (default: apt.log, overwritten every run)'
+    log_dir_help = 'log_dir: directory for a new log file per run, named after the input file and start time'
+    log_json_help = 'Write the log file as JSON lines, one record per line'
+    clean_help = 'Reject spikes before fitting: samples more than [-clean_k] scaled MADs from the rolling ' \
+                 'median of [-clean_window] samples'
+    clean_window_help = 'clean_window: odd # of samples per rolling window of [--clean]'
+    segment_help = 'Find the test in exports that include setup data: window every spec from its last ' \
+                   '(re-)inflation to its deflation, [--trim] overrides it for the specs it selects'
+    segment_step_help = 'segment_step: smallest change (PSI) between two samples counted as [--segment] ' \
+                        'inflation / deflation'
+    segment_ambient_help = 'segment_ambient: gauge pressure (PSI) below which [--segment] counts a spec as deflated'
+    clean_k_help = 'clean_k: [--clean] threshold in scaled MADs (~ noise standard deviations)'
+    outlier_report_help = 'outlier_report: *.csv listing every sample rejected by [--clean]'
+    timing_help = 'timing: *.json to write the per-stage timing summary of this run to'
+    profile_help = 'profile: *.prof to write cProfile stats of this run to (view with pstats/snakeviz)'
+    trace_memory_help = 'Trace memory with tracemalloc and record the peak per stage (slows the run down)'
+    loss_help = 'loss: curve fit loss, "linear" (default), or "soft_l1" / "huber" to limit the pull of outliers'
+    bootstrap_help = 'bootstrap: # of residual-bootstrap refits per spec for percentile intervals of a, b & c'
+    seed_help = 'seed: random seed of the [-bootstrap] resampling, re-use it to reproduce the intervals ' \
+                '(default: fresh entropy every run)'
     start_help = 'start: Where to start analyzing test data'
     end_help = 'end: Where to end analyzing test data'
 
@@ -112,6 +278,17 @@ def parse_args():
     args.add_argument('--trim', const=trim_item, action='store_const', dest='trim', default=0, help=trim_help)
     args.add_argument('--debug', const=debug_mode, action='store_const', dest='debug', default=0, help=debug_help)
     args.add_argument('--analyze', const=analyze, action='store_const', dest='analyze', default=0, help=analyze_help)
+    args.add_argument('--constant_memory', const=1, action='store_const', dest='constant_memory', default=0,
+                      help=constant_memory_help)
+    args.add_argument('--cache', const=1, action='store_const', dest='cache', default=0, help=cache_help)
+    args.add_argument('--no_cache', const=1, action='store_const', dest='no_cache', default=0, help=no_cache_help)
+    args.add_argument('--no_report', const=1, action='store_const', dest='no_report', default=0,
+                      help=no_report_help)
+    args.add_argument('--log_json', const=1, action='store_const', dest='log_json', default=0, help=log_json_help)
+    args.add_argument('--clean', const=1, action='store_const', dest='clean', default=0, help=clean_help)
+    args.add_argument('--segment', const=1, action='store_const', dest='segment', default=0, help=segment_help)
+    args.add_argument('--trace_memory', const=1, action='store_const', dest='trace_memory', default=0,
+                      help=trace_memory_help)
     args.add_argument('-f', const=1, action='store_const', dest='debug_file', default=0, help=f_help)
     args.add_argument('-c', const=1, action='store_const', dest='debug_stream', default=0, help=c_help)
     args.add_argument('-a', const=1, action='store_const', dest='debug_all', default=0, help=a_help)
@@ -121,10 +298,46 @@ def parse_args():
     args.add_argument('-n', type=str, nargs='+', help=n_help)
     args.add_argument('-xlsx', type=str, help=xlsx_help)
     args.add_argument('-csv', type=str, nargs='+', help=csv_help)
+    args.add_argument('-batch', type=str, help=batch_help)
+    args.add_argument('-out_dir', type=str, help=out_dir_help, default='.')
+    args.add_argument('-o', '-output', type=str, dest='output', help=output_help, default='temp.xlsx')
+    args.add_argument('-workers', type=int, help=workers_help, default=None)
+    args.add_argument('-cache_dir', type=str, help=cache_dir_help, default=None)
+    args.add_argument('-follow', type=str, help=follow_help)
+    args.add_argument('-interval', type=float, help=interval_help, default=60.0)
+    args.add_argument('-polls', type=int, help=polls_help, default=None)
+    args.add_argument('-sidecar', type=str, help=sidecar_help, default=None)
+    args.add_argument('-log', type=str, help=log_help, default='apt.log')
+    args.add_argument('-log_dir', type=str, help=log_dir_help, default=None)
+    args.add_argument('-clean_window', type=int, help=clean_window_help, default=11)
+    args.add_argument('-clean_k', type=float, help=clean_k_help, default=5.0)
+    args.add_argument('-segment_step', type=float, help=segment_step_help, default=2.0)
+    args.add_argument('-segment_ambient', type=float, help=segment_ambient_help, default=2.0)
+    args.add_argument('-outlier_report', type=str, help=outlier_report_help, default=None)
+    args.add_argument('-timing', type=str, help=timing_help, default=None)
+    args.add_argument('-profile', type=str, help=profile_help, default=None)
+    args.add_argument('-loss', type=str, choices=LOSSES, help=loss_help, default='linear')
+    args.add_argument('-bootstrap', type=int, help=bootstrap_help, default=None)
+    args.add_argument('-seed', type=int, help=seed_help, default=None)
     args.add_argument('-start', type=int, help=start_help, default=0)
     args.add_argument('-end', type=int, help=end_help, default=None)
 
-    return args.parse_args()
+    # input errors are reported here, before the logger, numpy or scipy are loaded
+    parsed = args.parse_args()
+    if not parsed.follow and not parsed.csv and not parsed.xlsx and not parsed.batch:
+        args.error('No input file defined, give one of -csv, -xlsx, -batch or -follow')
+    if parsed.csv and parsed.csv[0].split('.')[-1] != 'csv':
+        args.error('Wrong file type, given: "{}", expected: "{}"'.format(parsed.csv[0].split('.')[-1], 'csv'))
+    if parsed.xlsx and parsed.xlsx.split('.')[-1] != 'xlsx':
+        args.error('Wrong file type, given: "{}", expected: "{}"'.format(parsed.xlsx.split('.')[-1], 'xlsx'))
+    if parsed.seed is not None and parsed.bootstrap is None:
+        args.error('-seed only seeds the [-bootstrap] refits, give -bootstrap too')
+    if parsed.batch:
+        # each batch report is named after its input, these options name a single output
+        for option in ('sidecar', 'outlier_report', 'bootstrap'):
+            if getattr(parsed, option) is not None:
+                args.error('-{} is not supported with -batch, run the file on its own with -csv/-xlsx'.format(option))
+    return parsed
 
 
 if __name__ == '__main__':
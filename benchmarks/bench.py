@@ -0,0 +1,337 @@
+"""
+Read / fit / write benchmark of the bundled raw data and of synthetic tests scaled up to 1M samples
+and 50 specs. Every case runs in a fresh process, so peak RSS is per case.
+
+    python benchmarks/bench.py                              quick grid, compared to benchmarks/baseline.json
+    python benchmarks/bench.py -grid full -o results.json   10k-1M samples x 1-50 specs
+    python benchmarks/bench.py --save_baseline              store this run as the new baseline
+"""
+# core python imports
+import os
+import sys
+import time
+import glob
+import json
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows, peak RSS isn't recorded
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# relative imports
+from src import batch
+from src import timing
+from src import AptSpec as apt
+from src import write_xlsx as wx
+from benchmarks import synthetic
+
+CLI = os.path.join(ROOT, 'apt_v1.0.1.py')
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+REAL_FILES = [os.path.join('raw_data', '*.csv'), os.path.join('raw_data', '*.xlsx'),
+              os.path.join('bgAPT', 'raw_data.csv')]
+GRIDS = {
+    'quick': [(10000, 1), (10000, 10), (10000, 50), (100000, 1), (100000, 10)],
+    'full': [(samples, specs) for samples in (10000, 100000, 1000000) for specs in (1, 10, 50)],
+}
+# sample x spec count above which the *.xlsx report isn't written, it runs at ~13k spec samples/s
+WRITE_LIMIT = 200000
+MB = 1 << 20
+
+
+def real_cases():
+    """
+    :return: <list> of case dicts for the raw test files bundled with the repo
+    """
+    files = sorted(path for pattern in REAL_FILES for path in glob.glob(os.path.join(ROOT, pattern)))
+    return [{'name': os.path.relpath(path, ROOT).replace(os.sep, '/'), 'file': path} for path in files]
+
+
+def synthetic_cases(grid, data_dir, seed=0):
+    """
+    :param grid: <list> of (samples, specs)
+    :return: <list> of case dicts, the synthetic *.csv files are written to data_dir on first use
+    """
+    return [{'name': 'synthetic_{}x{}'.format(samples, specs),
+             'file': synthetic.test_file(data_dir, samples, specs, seed)} for samples, specs in grid]
+
+
+def peak_rss():
+    """
+    :return: <float> peak resident memory of this process so far, MB, 0.0 where it can't be measured
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(case, write=True, constant_memory=False, trace_memory=False):
+    """
+    read -> classify -> write of one test, timed with src/timing.py. Runs inside a fresh worker process.
+
+    :param case: <dict> name & file
+    :param write: <bool> write the *.xlsx report, only for cases up to WRITE_LIMIT
+    :param constant_memory: <bool> write the report in constant_memory mode
+    :param trace_memory: <bool> record the tracemalloc peak per stage (slower)
+    :return: <dict> case result, see summarize()
+    """
+    log = logging.getLogger('bench')
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    timing.timer.reset()
+    if trace_memory:
+        tracemalloc.start()
+
+    with timing.stage('read'):
+        data, order = batch.read_file(case['file'], 0, log)
+    timing.timer.records[-1]['rss_mb'] = peak_rss()
+
+    with timing.stage('classify'):
+        specs = apt.classify_data(data, log)
+    timing.timer.records[-1]['rss_mb'] = peak_rss()
+
+    samples = len(specs[0].datetime) if specs else 0
+    if write and samples * len(specs) <= WRITE_LIMIT:
+        with tempfile.TemporaryDirectory() as tmp:
+            with timing.stage('write'):
+                wx.write_xlsx(specs, order, data, log, file=os.path.join(tmp, 'report.xlsx'),
+                              constant_memory=constant_memory)
+        timing.timer.records[-1]['rss_mb'] = peak_rss()
+
+    if trace_memory:
+        tracemalloc.stop()
+    return summarize(case, samples, specs, timing.timer.records)
+
+
+def summarize(case, samples, specs, records):
+    """
+    Per-spec stages ("classify/fit/<spec>", "write/sheet/<spec>") are summed into "<parent>/*".
+
+    :return: <dict> name, samples, specs, failed_fits, stages: {stage: {seconds[, peak_mb, rss_mb]}}
+             & throughput: {top-level stage: spec samples per second}
+    """
+    stages = dict()
+    for record in records:
+        name = record['stage']
+        if name.count('/') > 1:
+            name = name.rsplit('/', 1)[0] + '/*'
+        stage = stages.setdefault(name, {'seconds': 0.0})
+        stage['seconds'] += record['seconds']
+        for key in ('peak_mb', 'rss_mb'):
+            if key in record:
+                stage[key] = max(stage.get(key, 0.0), record[key])
+
+    result = {
+        'name': case['name'],
+        'samples': samples,
+        'specs': len(specs),
+        'failed_fits': sum(1 for spec in specs if not spec.fit.success),
+        'stages': stages,
+    }
+    result['throughput'] = throughput(result)
+    return result
+
+
+def throughput(result):
+    """
+    :return: <dict> of top-level stage: spec samples per second
+    """
+    size = result['samples'] * result['specs']
+    return {name: size / stage['seconds'] for name, stage in result['stages'].items()
+            if '/' not in name and stage['seconds'] > 0}
+
+
+def best(results):
+    """
+    :param results: <list> of run_case() results of the same case
+    :return: <dict> result with the fastest time of every stage, like timeit's min of repeats
+    """
+    result = dict(results[0], stages=dict(), runs=len(results))
+    for name in results[0]['stages']:
+        result['stages'][name] = min((run['stages'][name] for run in results), key=lambda stage: stage['seconds'])
+    result['throughput'] = throughput(result)
+    return result
+
+
+def run(cases, write=True, constant_memory=False, trace_memory=False, repeat=3, log=None):
+    """
+    :param cases: <list> of case dicts
+    :param repeat: <int> runs per case, the fastest time of every stage is kept
+    :return: <list> of best() results, in the order of cases
+    """
+    results = []
+    for case in cases:
+        runs = []
+        for _ in range(repeat):
+            # a fresh process per run, so the peak RSS of one case doesn't carry into the next
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                runs.append(pool.submit(run_case, case, write, constant_memory, trace_memory).result())
+        results.append(best(runs))
+        if log:
+            log_result(results[-1], log)
+    return results
+
+
+def run_startup(repeat=3):
+    """
+    Wall time of "python apt_v1.0.1.py -h", the cost every scripted call of the CLI pays before any work.
+
+    :param repeat: <int> runs, the fastest is kept
+    :return: <dict> case result with a single "startup" stage
+    """
+    seconds = []
+    for _ in range(max(repeat, 5)):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, CLI, '-h'], stdout=subprocess.DEVNULL, check=True)
+        seconds.append(time.perf_counter() - t0)
+    return {'name': 'apt_v1.0.1.py -h', 'samples': 0, 'specs': 0, 'failed_fits': 0,
+            'stages': {'startup': {'seconds': min(seconds)}}, 'throughput': {}, 'runs': len(seconds)}
+
+
+def log_result(result, log):
+    stages = result['stages']
+    log.info('{:<62} {:>8} x {:>2}  {}  rss {:7.1f} MB'.format(
+        result['name'], result['samples'], result['specs'],
+        ' '.join('{} {:8.3f}s'.format(name, stages[name]['seconds']) if name in stages else '{} {:>9}'.format(name, '-')
+                 for name in ('read', 'classify', 'write')),
+        max(stage.get('rss_mb', 0.0) for stage in stages.values())))
+
+
+def compare(results, baseline, tolerance=0.5, min_seconds=0.05):
+    """
+    A stage regresses when it is slower than the baseline by more than tolerance, and by more than
+    min_seconds, so that millisecond stages don't flag on timer noise.
+
+    :param results: <list> of run_case() results
+    :param baseline: <dict> a stored results file
+    :return: <list> of (case, stage, baseline seconds, seconds, ratio) rows
+    :return: <list> of the regressed rows
+    """
+    cases = {result['name']: result for result in baseline['cases']}
+    rows = []
+    for result in results:
+        base = cases.get(result['name'])
+        if not base:
+            continue
+        for name, stage in result['stages'].items():
+            if name not in base['stages']:
+                continue
+            before = base['stages'][name]['seconds']
+            rows.append((result['name'], name, before, stage['seconds'], stage['seconds'] / before if before else 1.0))
+    regressions = [row for row in rows if row[4] > 1 + tolerance and row[3] - row[2] > min_seconds]
+    return rows, regressions
+
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    log = logging.getLogger('bench')
+
+    cases = []
+    if args.grid != 'synthetic':
+        cases += real_cases()
+    grid = GRIDS['full' if args.grid == 'full' else 'quick']
+    if args.samples or args.specs:
+        grid = [(samples, specs) for samples in args.samples or (10000,) for specs in args.specs or (1,)]
+    if args.grid != 'real':
+        log.info('preparing synthetic tests in "{}"'.format(args.data_dir))
+        cases += synthetic_cases(grid, args.data_dir, args.seed)
+
+    log.info('-'*75)
+    results = []
+    if args.grid != 'synthetic':
+        results.append(run_startup(args.repeat))
+        log.info('{:<62} startup {:8.3f}s'.format(results[-1]['name'], results[-1]['stages']['startup']['seconds']))
+    results += run(cases, write=not args.no_write, constant_memory=args.constant_memory,
+                   trace_memory=args.trace_memory, repeat=args.repeat, log=log)
+    report = {'machine': machine(), 'args': sys.argv[1:], 'cases': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+        log.info('results written to "{}"'.format(args.output))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        log.info('baseline written to "{}"'.format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        log.info('no baseline at "{}", run with [--save_baseline] to store one'.format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+
+    log.info('-'*75)
+    log.info('vs. baseline "{}" ({}, {} cpus)'.format(args.baseline, baseline['machine']['platform'],
+                                                      baseline['machine']['cpus']))
+    for case, name, before, after, ratio in rows:
+        flag = '  REGRESSION' if (case, name, before, after, ratio) in regressions else ''
+        if '/' not in name or args.verbose or flag:
+            log.info('{:<62} {:<16} {:8.3f}s -> {:8.3f}s  x{:.2f}{}'.format(case, name, before, after, ratio, flag))
+    if regressions:
+        log.error('{} stage(s) regressed by more than {:.0%}'.format(len(regressions), args.tolerance))
+        sys.exit(1)
+
+
+def parse_args():
+    """
+    :return: <Namespace> args.parse_args()
+    """
+    grid_help = 'grid: "quick" (default) or "full" (10k-1M samples x 1-50 specs) synthetic tests plus the ' \
+                'bundled raw data; "real" or "synthetic" runs only those'
+    samples_help = 'samples: synthetic test lengths, overrides the grid'
+    specs_help = 'specs: synthetic spec counts, overrides the grid'
+    output_help = 'o: *.json to write the results to'
+    baseline_help = 'baseline: stored results to compare against'
+    tolerance_help = 'tolerance: relative slowdown of a stage that counts as a regression'
+    min_seconds_help = 'min_seconds: absolute slowdown below which a stage never counts as a regression'
+    data_dir_help = 'data_dir: directory the synthetic tests are generated into and reused from'
+
+    args = argparse.ArgumentParser(description='APT read / fit / write benchmark')
+    args.add_argument('-grid', choices=('quick', 'full', 'real', 'synthetic'), default='quick', help=grid_help)
+    args.add_argument('-samples', type=int, nargs='+', default=None, help=samples_help)
+    args.add_argument('-specs', type=int, nargs='+', default=None, help=specs_help)
+    args.add_argument('-seed', type=int, default=0, help='seed: synthetic test seed')
+    args.add_argument('-data_dir', type=str, default=DATA_DIR, help=data_dir_help)
+    args.add_argument('-o', '-output', type=str, dest='output', default=None, help=output_help)
+    args.add_argument('-baseline', type=str, default=BASELINE, help=baseline_help)
+    args.add_argument('-repeat', type=int, default=3, help='repeat: runs per case, the fastest is kept')
+    args.add_argument('-tolerance', type=float, default=0.5, help=tolerance_help)
+    args.add_argument('-min_seconds', type=float, default=0.05, help=min_seconds_help)
+    args.add_argument('--save_baseline', const=1, action='store_const', dest='save_baseline', default=0,
+                      help='Store the results of this run as the new baseline')
+    args.add_argument('--no_write', const=1, action='store_const', dest='no_write', default=0,
+                      help='Skip the *.xlsx report stage')
+    args.add_argument('--constant_memory', const=1, action='store_const', dest='constant_memory', default=0,
+                      help='Write the report in constant_memory mode')
+    args.add_argument('--trace_memory', const=1, action='store_const', dest='trace_memory', default=0,
+                      help='Record the tracemalloc peak of every stage (slows the run down)')
+    args.add_argument('--verbose', const=1, action='store_const', dest='verbose', default=0,
+                      help='Compare the sub-stages too, e.g. read/parse')
+    return args.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import io
+import os
+import datetime
+
+import numpy as np
+
+INTERVAL = 1000  # seconds between logger rows, as in raw_data/
+START = datetime.datetime(2018, 6, 13, 19, 6, 40)
+CHUNK_ROWS = 10000
+
+
+def fit_func(t, a, b, c):
+    return a * np.exp(-b * t) + c
+
+
+def curve_params(specs, hours, rng):
+    """
+    Decay parameters like bgAPT/sanity_check.py (a=2.5, b=1.3, c=0.5 over 4 time units), scaled so
+    every curve decays by ~2-6 time constants over the whole test whatever its length.
+
+    :param specs: <int> number of specs
+    :param hours: <float> test length
+    :param rng: <Generator>
+    :return: <ndarray> (specs, 3) [a, b, c] per spec
+    """
+    a = rng.uniform(2.0, 8.0, specs)
+    b = rng.uniform(2.0, 6.0, specs) / hours
+    c = rng.uniform(20.0, 26.0, specs)
+    return np.column_stack([a, b, c])
+
+
+def stamp(moment):
+    """
+    :param moment: <datetime>
+    :return: <str> "m/d/yyyy,h:mm:ss AM/PM", the logger's date & time columns
+    """
+    hour = moment.hour % 12 or 12
+    return '{}/{}/{},{}:{:02d}:{:02d} {}'.format(moment.month, moment.day, moment.year, hour, moment.minute,
+                                                 moment.second, 'AM' if moment.hour < 12 else 'PM')
+
+
+def write_test(file, samples, specs, seed=0, noise=0.02):
+    """
+    Writes a synthetic logger *.csv export: the three-row header (name, sample #, unit) and one row
+    per sample with a noisy decay per spec, barometric pressure and three temperatures.
+
+    :param file: <str> output *.csv path
+    :param samples: <int> number of rows
+    :param specs: <int> number of spec columns
+    :param seed: <int> random seed, the same arguments always write the same file
+    :param noise: <float> standard deviation of the pressure noise (PSI)
+    :return: <ndarray> (specs, 3) the [a, b, c] the curves were generated with
+    """
+    rng = np.random.default_rng(seed)
+    hours = samples * INTERVAL / 3600
+    params = curve_params(specs, hours, rng)
+    names = ['P{}'.format(40 + i) for i in range(specs)]
+
+    if os.path.dirname(file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = file + '.tmp'
+    with open(tmp, 'w', newline='', encoding='latin-1') as f:
+        f.write(',,' + ','.join(names + ['Baro', 'T1', 'T2', 'T3']) + '\n')
+        f.write(',,' + ','.join([str(i + 1) for i in range(specs)] + [''] * 4) + '\n')
+        f.write(',,' + ','.join(['[PSI]'] * specs + ['[in.hga]'] + ['[\xb0C]'] * 3) + '\n')
+
+        for first in range(0, samples, CHUNK_ROWS):
+            rows = np.arange(first, min(first + CHUNK_ROWS, samples))
+            t = rows * INTERVAL / 3600
+            psi = fit_func(t[:, None], *params.T) + rng.normal(0, noise, (len(rows), specs))
+            baro = 28.66 + rng.normal(0, 0.005, (len(rows), 1))
+            temps = 22.2 + np.sin(2 * np.pi * t / 24)[:, None] + rng.normal(0, 0.05, (len(rows), 3))
+
+            buffer = io.StringIO()
+            np.savetxt(buffer, np.hstack([psi, baro, temps]), fmt='%.3f', delimiter=',')
+            stamps = [stamp(START + datetime.timedelta(seconds=int(row) * INTERVAL)) for row in rows]
+            f.writelines(s + ',' + line + '\n' for s, line in zip(stamps, buffer.getvalue().splitlines()))
+    os.replace(tmp, file)
+    return params
+
+
+def test_file(data_dir, samples, specs, seed=0):
+    """
+    :return: <str> path of the synthetic test, written on first use and reused after that
+    """
+    file = os.path.join(data_dir, 'synthetic_{}x{}_seed{}.csv'.format(samples, specs, seed))
+    if not os.path.exists(file):
+        write_test(file, samples, specs, seed)
+    return file
@@ -7,21 +7,13 @@ import json
 import logging
 import datetime
 
-# 3rd party imports
+# 3rd party imports; xlrd, scipy, matplotlib & openpyxl are imported by the functions that use them
 from pytz import timezone
 import numpy as np
-import xlwt
-import xlrd
-import openpyxl
-from openpyxl.chart import (
-    ScatterChart,
-    Reference,
-    Series,
 
-)
-import matplotlib.pyplot as plt
-from scipy import stats
-from scipy.optimize import curve_fit
+# the decay-fit helpers are shared with the main package in ../src
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
 
 
 BLESSED_TEMP = 22.2222222  # deg C for normalization
@@ -104,8 +96,11 @@ class AirPermSpec:
         log.info('len(self.t): {}'.format(len(self.t)))
         log.info('len(self.p): {}'.format(len(self.p)))
         log.info('--'*50)
+        from scipy.optimize import curve_fit
+        from src import exp_fit
         try:
-            self.popt, self.pcov = curve_fit(self.exp_model, self.t, self.p)
+            self.popt, self.pcov = curve_fit(self.exp_model, self.t, self.p,
+                                             p0=exp_fit.initial_guess(self.t, self.p), jac=exp_fit.exp_jacobian)
         except RuntimeError as re:
             log.error(re)
             self.popt = [0, 0, 0]
@@ -123,6 +118,7 @@ class AirPermSpec:
         return np.array(norm_p)
 
     def exp_pb(self, conf=0.95):
+        from scipy import stats
 
         xd = self.t
         yd = self.p
@@ -187,6 +183,8 @@ class AirPermSpec:
         return np.sqrt(np.diag(self.pcov))
 
     def plot(self):
+        import matplotlib.pyplot as plt
+
         xd = self.t
         yd = self.p
         yd_nom = self.nom_p
@@ -219,6 +217,8 @@ class AirPermThermocouples:
 
 
 def main(input, start, output, template='apt_report_template.xlsx'):
+    import matplotlib.pyplot as plt
+
     log.info('CALLING read_xlsx(input_file={})'.format(input))
     apt = read_xlsx(input, start)
     # log.debug('{}'.format(apt.avg_temp_kelvin[0:5]))
@@ -246,6 +246,7 @@ def read_xlsx(file, start):
     data = {}
     dates = []
     times = []
+    import xlrd
     wb = xlrd.open_workbook(file)
     log.debug("workbook: {}".format(wb))
     log.debug("workbook._sheet_names: {}".format(wb._sheet_names))
@@ -356,6 +357,8 @@ def write_formulae(worksheet, n):
 
 
 def write_plots(worksheet, spec):
+    from openpyxl.chart import ScatterChart, Reference, Series
+
     chart = ScatterChart()
     chart.title = 'Measured Data w/ Exponential Fit \n Pressure vs. Temperature'
     chart.style = 13
@@ -423,6 +426,7 @@ def write_spec_summary(wb, i, worksheet, spec):
 
 
 def write_xlsx(data, file, template):
+    import openpyxl
 
     wb = openpyxl.load_workbook(template)
 
@@ -1,11 +1,17 @@
-import time
+import datetime
 import numpy as np
 
-from scipy import optimize
+from src import exp_fit
+from src import bootstrap as bs
+from src import outliers as ol
+from src import timing
 
 CELSIUS_2_KELVIN = 273.15
 IDEAL_APT_ROOM = 22.22222
 
+# initial capacity of the column buffers of a spec that is appended to, see AptSpec.append()
+MIN_CAPACITY = 1024
+
 
 class AptSpec:
     def __init__(self, name, trim=None, **kwargs):
@@ -13,85 +19,459 @@ class AptSpec:
         :param name: parsed name of the measured spec
         :param trim: <Trim> object that has an attribute "start" and "end" for slicing signals
         :param kwargs: <dict> that should contain keys:
-            psi: <list> of <str> objects that should be <float> convertible
-            baro: <list> of <str> objects that should be <float> convertible
-            datetime: <list> of <str> objects that should be <datetime> objects
-            t#: <list> of <dict> objects where:
-                    key: thermocouple name
-                    value: <list> of <str> objects that should be <float> convertible
-        """
-        # predefined (expected class attributes)
+            psi: <list> or <ndarray> of <float> convertible values
+            baro: <list> or <ndarray> of <float> convertible values
+            datetime: <list> of <datetime> objects or <ndarray> of <datetime64>
+            valid: <ndarray> of <bool>, rows with a reading, default=None: psi is finite & datetime isn't
+                   NaT, computed per data window
+            t#: <list> or <ndarray> of <float> convertible thermocouple readings (Celsius),
+                one key per thermocouple
+            first_row: <int> data row of the file the columns begin at, default=0
+        """
+        # predefined (expected class attributes), full-length column arrays. These are kept as given
+        # (no copy for float64/datetime64 input, e.g. memory-mapped cache columns); psi, baro, datetime
+        # and temps are exposed through the data window, see set_window()
         self.name = name
-        self.psi = list()
-        self.baro = list()
-        self.datetime = list()
-        self.temps = list()
+        self._psi = np.array([], dtype=np.float64)
+        self._baro = np.array([], dtype=np.float64)
+        self._datetime = np.array([], dtype='datetime64[s]')
+        self._valid = None
+        self._temps = tuple()
+        self.thermocouples = list()
+        self.loss = 'linear'
+        self._weights = None
+        self.outlier_rule = None
+        self.p0 = None
+        self.first_row = 0
+        self._buffers = dict()
 
         # populating instantiated variables,
         # handles a flexible amount of thermocouples
+        temps = list()
         for key, value in kwargs.items():
-            if not trim:
-                if len(key) == 2 and key[0] == 't':
-                    self.temps.append({key: value})
-                else:
-                    setattr(self, key, value)
+            if len(key) == 2 and key[0] == 't':
+                self.thermocouples.append(key)
+                temps.append(np.asarray(value, dtype=np.float64))
+            elif key == 'datetime':
+                # kept as is when already datetime64[s]: asarray() returns a new view of it, and specs
+                # sharing one datetime column (by id) are fitted together, see fit_specs()
+                is_datetime = isinstance(value, np.ndarray) and value.dtype == np.dtype('datetime64[s]')
+                self._datetime = value if is_datetime else np.asarray(value, dtype='datetime64[s]')
+            elif key in ('psi', 'baro'):
+                setattr(self, '_' + key, np.asarray(value, dtype=np.float64))
+            elif key == 'valid':
+                self._valid = np.asarray(value, dtype=bool)
             else:
-                if len(key) == 2 and key[0] == 't':
-                    self.temps.append({key: value[trim.start:trim.end]})
-                else:
-                    setattr(self, key, value[trim.start: trim.end])
+                setattr(self, key, value)
+
+        if temps:
+            self._temps = tuple(temps)
+
+        # derived arrays & the curve fit, computed once per data window
+        self._cache = dict()
+        self._window = slice(None)
+        if trim:
+            self.set_window(trim.start, trim.end)
+
+    def set_window(self, start=None, end=None):
+        """
+        Selects the samples [start:end] used for every derived signal and the curve fit.
+        Changing the window invalidates the cached values.
+
+        :param start: <int> first sample index, default=None
+        :param end: <int> end sample index (exclusive), default=None
+        """
+        window = slice(start, end)
+        if (window.start, window.stop) != (self._window.start, self._window.stop):
+            self._window = window
+            self._cache.clear()
+
+    @property
+    def window(self):
+        return self._window
+
+    def set_fit_options(self, loss='linear', weights=None):
+        """
+        Selects how the decay model is fitted. Changing the options invalidates the cached values.
+
+        :param loss: <str> 'linear' (least squares), or the robust 'soft_l1' / 'huber', see exp_fit.LOSSES
+        :param weights: <ndarray> full-length per-sample weights, windowed like psi, default=None
+        """
+        if loss not in exp_fit.LOSSES:
+            raise ValueError('loss must be one of {}, given: "{}"'.format(exp_fit.LOSSES, loss))
+        self.loss = loss
+        self._weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        self._cache.clear()
+
+    def set_outlier_rule(self, rule=None):
+        """
+        Rejects spikes from the fit, see outliers.OutlierRule. Changing the rule invalidates the cached values.
+
+        :param rule: <OutlierRule>, default=None fits every measured sample
+        """
+        self.outlier_rule = rule
+        self._cache.clear()
+
+    def append(self, axis=None, **kwargs):
+        """
+        Appends newly logged samples to the full-length columns, e.g. while following a live test.
+        The columns grow inside over-allocated buffers, so an append only copies the new samples
+        (plus an occasional doubling). The cached values are invalidated; a successful fit is kept
+        as the warm start (p0) of the next one.
+
+        :param axis: <ndarray> datetime column already extended by a spec sharing this one's time axis,
+                     default=None extends its own; see append_specs()
+        :param kwargs: <dict> the new samples, with the same keys as __init__()
+        """
+        fit = self._cache.get('fit')
+        if fit is not None and fit.success:
+            self.p0 = fit.popt
+
+        n = len(self._datetime)
+        if axis is None:
+            self._datetime = self._extend('datetime', self._datetime, kwargs['datetime'], 'datetime64[s]')
+        else:
+            self._datetime = axis
+        self._psi = self._extend('psi', self._psi, kwargs['psi'], np.float64)
+        # only a mask given by the caller is stored, rows it doesn't cover are all True (see measured)
+        valid = kwargs.get('valid')
+        if self._valid is not None or valid is not None:
+            if self._valid is None:
+                self._valid = np.ones(n, dtype=bool)
+            if valid is None:
+                valid = np.ones(len(self._datetime) - n, dtype=bool)
+            self._valid = self._extend('valid', self._valid, valid, bool)
+        if 'baro' in kwargs:
+            self._baro = self._extend('baro', self._baro, kwargs['baro'], np.float64)
+        self._temps = tuple(self._extend(key, temp, kwargs[key], np.float64)
+                            for key, temp in zip(self.thermocouples, self._temps))
+        if self._weights is not None:
+            self._weights = self._extend('weights', self._weights, np.ones(len(self._datetime) - n), np.float64)
+        self._cache.clear()
+
+    def _extend(self, name, column, values, dtype):
+        values = np.asarray(values, dtype=dtype)
+        n, k = len(column), len(values)
+        buffer = self._buffers.get(name)
+        if buffer is None or len(buffer) < n + k:
+            buffer = np.empty(max(2 * (n + k), MIN_CAPACITY), dtype=dtype)
+            buffer[:n] = column
+            self._buffers[name] = buffer
+        buffer[n:n + k] = values
+        return buffer[:n + k]
+
+    @property
+    def weights(self):
+        return None if self._weights is None else self._weights[self._window]
+
+    @property
+    def psi(self):
+        return self._psi[self._window]
+
+    @property
+    def baro(self):
+        return self._baro[self._window]
+
+    @property
+    def datetime(self):
+        return self._datetime[self._window]
+
+    @property
+    def measured(self):
+        """
+        :return: <ndarray> of <bool> samples of the window with a reading, a timestamp and at least
+                 one thermocouple reading (and in the valid mask, if one was given)
+        """
+        if 'measured' not in self._cache:
+            measured = np.isfinite(self.psi) & ~np.isnat(self.datetime) & np.isfinite(self.avg_temp)
+            if self._valid is not None:
+                measured &= self._valid[self._window]
+            self._cache['measured'] = measured
+        return self._cache['measured']
+
+    @property
+    def rejected(self):
+        """
+        :return: <ndarray> of <bool> measured samples of the window rejected as outliers by the outlier_rule
+        """
+        if 'rejected' not in self._cache:
+            if self.outlier_rule is None:
+                self._cache['rejected'] = np.zeros(len(self.datetime), dtype=bool)
+            else:
+                ol.detect_specs([self])
+        return self._cache['rejected']
+
+    @property
+    def outlier_stats(self):
+        """
+        :return: median, threshold <ndarray> of the outlier_rule, per sample of the window
+        """
+        self.rejected
+        return self._cache['outlier_stats']
+
+    @property
+    def valid(self):
+        """
+        :return: <ndarray> of <bool> measured samples that weren't rejected as outliers; the fit and
+                 the summary metrics only use these
+        """
+        if 'valid' not in self._cache:
+            self._cache['valid'] = self.measured & ~self.rejected
+        return self._cache['valid']
+
+    @property
+    def complete(self):
+        """
+        :return: <bool> True if every sample of the window is valid
+        """
+        if 'complete' not in self._cache:
+            self._cache['complete'] = bool(self.valid.all())
+        return self._cache['complete']
+
+    @property
+    def temps(self):
+        """
+        :return: <ndarray> (n_thermocouples, n_samples) readings of the window, stacked on access
+        """
+        if not self._temps:
+            return np.empty((0, 0), dtype=np.float64)
+        return np.vstack([temp[self._window] for temp in self._temps])
+
+    @property
+    def start_datetime(self):
+        """
+        :return: <datetime> first sample of the test as a python datetime object, None for an empty window
+        """
+        origin = self.origin
+        return None if origin is None else origin.astype(datetime.datetime)
+
+    @property
+    def origin(self):
+        """
+        :return: <datetime64[s]> first timestamp of the window, skipping rows without a date; None if there is none
+        """
+        datetime = self.datetime
+        if len(datetime) and not np.isnat(datetime[0]):
+            return datetime[0]
+        dated = np.flatnonzero(~np.isnat(datetime))
+        return datetime[dated[0]] if len(dated) else None
 
     @property
     def avg_temp(self):
         """
-        Averages an array of thermocouple readings and converts them to Kelvin from Celsius
+        Averages an array of thermocouple readings and converts them to Kelvin from Celsius, a
+        missing reading is left out of its sample's average (NaN if all are missing)
         :return: temp(K)
         """
-        values = list()
-        temps = list()
-        for item in self.temps:
-            for key in dict.keys(item):
-                values = [float(value)+CELSIUS_2_KELVIN for value in item[key]]
-            temps.append(values)
-        return list(np.mean(np.array(temps), axis=0))
+        if 'avg_temp' not in self._cache:
+            temps = self.temps
+            finite = np.isfinite(temps)
+            if finite.all():
+                avg = temps.mean(axis=0)
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    avg = np.where(finite, temps, 0).sum(axis=0) / finite.sum(axis=0)
+            self._cache['avg_temp'] = avg + CELSIUS_2_KELVIN
+        return self._cache['avg_temp']
 
     @property
     def time(self):
         """
-        Converts datetime object to a floating point number of hours
+        Converts datetime object to a floating point number of hours since the first dated sample, NaN
+        for a row without a date
         :return: time (hours)
         """
-        t0 = time.mktime(self.datetime[0].timetuple())
-        t = [time.mktime(tN.timetuple()) - t0 for tN in self.datetime]
-        return np.array([val/3600 for val in t])
+        if 'time' not in self._cache:
+            origin = self.origin
+            if origin is None:
+                # an empty (or undated) window, e.g. -start past the end of the file; fit() reports too_few_samples
+                self._cache['time'] = np.full(len(self.datetime), np.nan)
+            else:
+                self._cache['time'] = (self.datetime - origin) / np.timedelta64(1, 'h')
+        return self._cache['time']
 
     @property
     def pressure(self):
-        p = list()
-        for i, val in enumerate(self.psi):
-            p.append((val*(IDEAL_APT_ROOM+CELSIUS_2_KELVIN))/(self.avg_temp[i]))
-        return np.array(p)
+        """
+        Normalizes the measured pressure to the ideal APT room temperature
+        :return: pressure (PSI)
+        """
+        if 'pressure' not in self._cache:
+            self._cache['pressure'] = self.psi * (IDEAL_APT_ROOM + CELSIUS_2_KELVIN) / self.avg_temp
+        return self._cache['pressure']
+
+    @property
+    def valid_time(self):
+        """
+        :return: time (hours) of the valid samples, the whole window if it's complete
+        """
+        return self.time if self.complete else self.time[self.valid]
+
+    @property
+    def valid_pressure(self):
+        """
+        :return: pressure (PSI) of the valid samples, the whole window if it's complete
+        """
+        return self.pressure if self.complete else self.pressure[self.valid]
+
+    @property
+    def valid_weights(self):
+        """
+        :return: per-sample weights of the valid samples, None if the fit is unweighted
+        """
+        weights = self.weights
+        if weights is None or self.complete:
+            return weights
+        return weights[self.valid]
+
+    @property
+    def fit(self):
+        """
+        Fits the exponential decay model once per data window
+        :return: <FitResult>
+        """
+        if 'fit' not in self._cache:
+            self._cache['fit'] = exp_fit.fit(self.valid_time, self.valid_pressure, p0=self.p0, loss=self.loss,
+                                             weights=self.valid_weights)
+        return self._cache['fit']
 
     def curve_fit(self):
-        try:
-            popt, pcov = optimize.curve_fit(self.exp_model, self.time, self.pressure)
-            return {
-                'popt': popt,
-                'pcov': pcov}
-        except RuntimeError as re:
-            return {
-                'popt': np.array([0, 0, 0]),
-                'pcov': np.array([[0, 0, 0],
-                                  [0, 0, 0],
-                                  [0, 0, 0]])
-            }
+        return self.fit
 
     @staticmethod
     def exp_model(t, a, b, c):
-        return a * np.exp(-b * t) + c
+        return exp_fit.exp_model(t, a, b, c)
+
+    def bands(self, t=None, conf=exp_fit.CONFIDENCE):
+        """
+        :param t: <ndarray> time (hours) to evaluate at, default=None uses the sample times (cached per fit)
+        :param conf: <float> confidence level
+        :return: <dict> as returned by exp_fit.bands()
+        """
+        if t is not None:
+            return exp_fit.bands(self.fit, t, conf)
+
+        key = ('bands', conf)
+        if key not in self._cache:
+            self._cache[key] = exp_fit.bands(self.fit, self.time, conf)
+        return self._cache[key]
+
+    def bootstrap(self, n=1000, conf=exp_fit.CONFIDENCE, seed=None, workers=None):
+        """
+        Residual bootstrap of the fit with the same fit options, cached per data window
+        :param n: <int> number of refits
+        :param conf: <float> confidence level of the percentile intervals
+        :param seed: <int> random seed, default=None
+        :param workers: <int> worker processes, default=None refits in-process
+        :return: <BootstrapResult> percentile intervals of a, b, c & projected pressure
+        """
+        key = ('bootstrap', n, conf, seed)
+        if key not in self._cache:
+            self._cache[key] = bs.bootstrap(self.valid_time, self.valid_pressure, self.fit, n, conf,
+                                            bs.spec_seed(seed, self.name), workers, self.loss, self.valid_weights)
+        return self._cache[key]
+
+    def exp_confidence_bands(self, t=None, conf=exp_fit.CONFIDENCE):
+        """
+        :return: lower, upper <ndarray> confidence band of the fitted curve
+        """
+        return self.bands(t, conf)['confidence']
+
+    def exp_prediction_bands(self, t=None, conf=exp_fit.CONFIDENCE):
+        """
+        :return: lower, upper <ndarray> prediction band of a single measurement
+        """
+        return self.bands(t, conf)['prediction']
+
+
+def append_specs(specs, data):
+    """
+    Appends newly logged samples to every spec. Specs that shared a time axis keep sharing one
+    datetime column, so fit_specs() & co. still stack them.
+
+    :param specs: <list> of <AptSpec>
+    :param data: <dict> of spec name: the new samples, see AptSpec.append()
+    """
+    axes = dict()
+    for spec in specs:
+        key = id(spec._datetime)
+        spec.append(axis=axes.get(key), **data[spec.name])
+        axes.setdefault(key, spec._datetime)
+
+
+def fit_specs(specs):
+    """
+    Fits every spec that doesn't have a cached fit yet. Specs built from the same test file share
+    one time axis, so plain least-squares specs are grouped and solved together with
+    exp_fit.fit_batch(); any spec the batch can't fit (or that doesn't line up with its time axis, has
+    invalid samples, or uses a robust loss / weights) goes through the fallback chain of AptSpec.fit.
+
+    :param specs: <list> of <AptSpec>
+    :return: <list> of <FitResult>, in the order of specs
+    """
+    ol.detect_specs([spec for spec in specs if 'fit' not in spec._cache])
+
+    groups = dict()
+    for spec in specs:
+        if 'fit' in spec._cache or len(spec.psi) != len(spec.datetime) or len(spec.psi) < 4:
+            continue
+        if spec.loss != 'linear' or spec._weights is not None or not spec.complete:
+            continue
+        key = (id(spec._datetime), spec.window.start, spec.window.stop)
+        groups.setdefault(key, list()).append(spec)
+
+    for group in groups.values():
+        pressure = np.array([spec.pressure for spec in group])
+        finite = np.all(np.isfinite(pressure), axis=1)
+        group = [spec for spec, ok in zip(group, finite) if ok]
+        if len(group) < 2:
+            continue
+        p0 = np.array([exp_fit.initial_guess(spec.time, p) if spec.p0 is None else spec.p0
+                       for spec, p in zip(group, pressure[finite])])
+        results = exp_fit.fit_batch(group[0].time, pressure[finite], p0)
+        for spec, result in zip(group, results):
+            if result.success:
+                spec._cache['fit'] = result
+
+    return [spec.fit for spec in specs]
+
+
+def classify_data(data, log, trims=None, loss='linear', outlier_rule=None):
+    """
+    :param data: <dict> of spec key: AptSpec kwargs, as returned by read_xlsx() / read_csv()
+    :param log: <Logger> transporting python logger into this function for debugging.
+    :param trims: <dict> of spec key: <Trim> windowing the selected specs, see trim.TrimRule and
+                  segment.SegmentRule, default=None
+    :param loss: <str> loss function of the curve fits, see exp_fit.LOSSES
+    :param outlier_rule: <OutlierRule> rejecting spikes before the fits, default=None
+    :return: <list> of fitted <AptSpec>
+    """
+    log.info('-'*75)
+    trims = trims or dict()
+    specs = []
+    for i, key in enumerate(dict.keys(data)):
+        specs.append(AptSpec(key, trim=trims.get(key), **data[key]))
+        specs[-1].set_fit_options(loss=loss)
+        specs[-1].set_outlier_rule(outlier_rule)
+        if key in trims:
+            end = '' if trims[key].end is None else trims[key].end
+            log.info('AptSpec: "{}" trimmed to samples [{}:{}]'.format(key, trims[key].start, end))
+
+    if outlier_rule:
+        with timing.stage('classify/outliers'):
+            ol.detect_specs(specs)
+        ol.log_report(specs, log)
+
+    with timing.stage('classify/fit'):
+        fits = fit_specs(specs)
 
-    def exp_confidence_bands(self):
-        return self.name
+    for spec, fit in zip(specs, fits):
+        timing.timer.add('classify/fit/' + spec.name, fit.wall_time)
+        if fit.success:
+            log.info('AptSpec: "{}" curve_fit successful'.format(spec.name))
+        else:
+            log.warning('AptSpec: "{}" curve_fit failed ({}): {}'.format(spec.name, fit.reason, fit.message))
+        log.debug('AptSpec: "{}" {}'.format(spec.name, fit))
+    log.info('-' * 75)
 
-    def exp_prediction_bands(self):
-        return self.name
+    return specs
@@ -1,19 +1,89 @@
+import os
+import copy
+import json
+import queue
+import atexit
 import logging
 import datetime
+import multiprocessing
+from logging.handlers import QueueHandler, QueueListener
 from pytz import timezone
 
+LOGGER = 'status'
+LOG_FILE = 'apt.log'
+FORMAT = '%(name)s - %(funcName)15s - %(lineno)d - %(levelname)s - %(message)s'
 
-def create_logger(debug, file, stream, full):
-    formatter = logging.Formatter('%(name)s - %(funcName)15s - %(lineno)d - %(levelname)s - %(message)s')
+# the listener thread of this process, and the one forwarding the records of pool workers
+_listener = None
+_worker_listener = None
+_worker_queue = None
 
-    filelog = logging.getLogger('status')
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        """
+        :return: <str> the record as one JSON object per line
+        """
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'func': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage()
+        }
+        # rendered by MessageQueueHandler.prepare(), or here for a record logged without the queue
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry)
+
+
+class MessageQueueHandler(QueueHandler):
+    def prepare(self, record):
+        """
+        Only merges the args into the message, unlike QueueHandler, which runs the whole format on
+        the caller: the args may change before the listener gets to the record, or not pickle into
+        a worker queue. A traceback is rendered here too, it can't cross a process queue either.
+
+        :return: <LogRecord> a copy of record, formatted by the listener's handlers
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def create_logger(debug, file, stream, full, log_file=LOG_FILE, json_lines=False):
+    """
+    Routes the 'status' logger through a queue: callers only merge the message & enqueue the record,
+    a QueueListener thread formats it and writes the console & file handlers. Calling it again replaces the previous
+    setup, handlers are never stacked.
+
+    :param log_file: <str> path of the log file, default="apt.log" in the working directory
+    :param json_lines: <bool> write the log file as JSON lines instead of formatted text
+    :return: <Logger>
+    """
+    global _listener
+    shutdown()
+
+    formatter = logging.Formatter(FORMAT)
+
+    filelog = logging.getLogger(LOGGER)
     filelog.setLevel(logging.DEBUG)
 
     ch = logging.StreamHandler()
     ch.setFormatter(formatter)
 
-    fh = logging.FileHandler(filename='apt.log', mode='w')
-    fh.setFormatter(formatter)
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    fh = logging.FileHandler(filename=log_file, mode='w')
+    fh.setFormatter(JsonFormatter() if json_lines else formatter)
 
     if stream or full:
         ch.setLevel(logging.DEBUG)
@@ -25,13 +95,83 @@ def create_logger(debug, file, stream, full):
     else:
         fh.setLevel(logging.DEBUG)
 
-    filelog.addHandler(fh)
-    filelog.addHandler(ch)
+    records = queue.SimpleQueue()
+    filelog.addHandler(MessageQueueHandler(records))
+    _listener = QueueListener(records, ch, fh, respect_handler_level=True)
+    _listener.start()
     return filelog
 
 
-def init(debug, file, stream, full):
-    log = create_logger(debug, file, stream, full)
+def shutdown():
+    """
+    Drains the queue, stops the listener threads and closes the handlers. Safe to call more than
+    once; runs at exit.
+    """
+    global _listener, _worker_listener, _worker_queue
+    filelog = logging.getLogger(LOGGER)
+    for handler in list(filelog.handlers):
+        if isinstance(handler, QueueHandler):
+            filelog.removeHandler(handler)
+
+    if _worker_listener is not None:
+        _worker_listener.stop()
+        _worker_queue.close()
+        _worker_listener, _worker_queue = None, None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown)
+
+
+def worker_queue():
+    """
+    :return: <multiprocessing.Queue> for pool workers to log to (see init_worker()), its records are
+             written by this process's handlers; None if create_logger() hasn't been called
+    """
+    global _worker_listener, _worker_queue
+    if _listener is None:
+        return None
+    if _worker_queue is None:
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = QueueListener(_worker_queue, *_listener.handlers, respect_handler_level=True)
+        _worker_listener.start()
+    return _worker_queue
+
+
+def init_worker(records):
+    """
+    Pool initializer: replaces the handlers a worker inherited from its parent with a
+    MessageQueueHandler to records, so only the parent writes the console & log file.
+
+    :param records: <multiprocessing.Queue> from worker_queue(), None leaves logging as is
+    """
+    if records is None:
+        return
+    filelog = logging.getLogger(LOGGER)
+    for handler in list(filelog.handlers):
+        filelog.removeHandler(handler)
+    filelog.setLevel(logging.DEBUG)
+    filelog.addHandler(MessageQueueHandler(records))
+
+
+def log_path(log_dir, name, json_lines=False):
+    """
+    :param log_dir: <str> directory of the per-run log files
+    :param name: <str> input the run is named after, e.g. "P-65 Sealant 1__0_2018-06-13_19-06-40_000000.csv"
+    :param json_lines: <bool> *.jsonl instead of *.log
+    :return: <str> "<log_dir>/<name stem>_<YYYYmmdd-HHMMSS>.log"
+    """
+    stem = os.path.splitext(os.path.basename(os.path.normpath(name)))[0] or 'apt'
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(log_dir, '{}_{}.{}'.format(stem, stamp, 'jsonl' if json_lines else 'log'))
+
+
+def init(debug, file, stream, full, log_file=LOG_FILE, json_lines=False):
+    log = create_logger(debug, file, stream, full, log_file, json_lines)
     fmt = '%Y-%m-%d | %H:%M:%S'
 
     log.info('==============================================================================')
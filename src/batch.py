@@ -0,0 +1,165 @@
+import os
+import re
+import glob
+import time
+import logging
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import apt_logger
+from src import read_xlsx as rx
+from src import read_csv as rc
+from src import AptSpec as apt
+from src import write_xlsx as wx
+from src import segment as sg
+
+INPUT_TYPES = ('csv', 'xlsx')
+DATE_PATTERN = re.compile(r'\d{4}[-_]\d{2}[-_]\d{2}')
+
+
+def find_inputs(pattern):
+    """
+    :param pattern: <str> directory of raw test files, or a glob pattern
+    :return: <list> of <str> input paths, sorted. When a test ships as both *.csv and *.xlsx
+             only the *.csv is kept, since both produce the same report.
+    """
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+
+    inputs = dict()
+    for path in sorted(paths):
+        ext = path.split('.')[-1].lower()
+        if os.path.isfile(path) and ext in INPUT_TYPES:
+            name = report_name(path)
+            if name not in inputs or ext == 'csv':
+                inputs[name] = path
+
+    return sorted(inputs.values())
+
+
+def report_name(path):
+    """
+    Names a report after its raw test file, like the files in reports/:
+        "P-65 Sealant 1__0_2018-06-13_19-06-40_000000.csv" -> "p65_sealant_1_2018-06-13_results.xlsx"
+
+    :param path: <str> raw test file path
+    :return: <str> report file name
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    name, _, rest = stem.partition('__')
+    name = re.sub(r'[\s_]+', '_', name.replace('-', '')).strip('_').lower()
+    date = DATE_PATTERN.search(rest)
+    if date:
+        name = name + '_' + date.group(0)
+    if not name.endswith('_results'):
+        name = name + '_results'
+    return name + '.xlsx'
+
+
+def read_file(file, start, log, end=None, cache_dir=None):
+    """
+    :param file: <str> raw *.csv or *.xlsx test file
+    :param start: <int> first data row
+    :param log: <Logger>
+    :param end: <int> end data row, default=None
+    :param cache_dir: <str> directory of the parsed-column cache, default=None disables it
+    :return: data, order as returned by read_csv() / read_xlsx()
+    """
+    if file.split('.')[-1].lower() == 'csv':
+        return rc.read_csv(file=file, start=start, log=log, end=end, cache_dir=cache_dir)
+    return rx.read_xlsx(file=file, start=start, log=log, end=end, cache_dir=cache_dir)
+
+
+def process_file(file, out_dir, start=0, end=None, constant_memory=False, cache_dir=None, trim_rule=None,
+                 loss='linear', outlier_rule=None, segment_rule=None):
+    """
+    read -> classify -> write for a single raw test file, run inside a pool worker.
+
+    :param file: <str> raw *.csv or *.xlsx test file
+    :param out_dir: <str> directory to write the report to
+    :param start: <int> first data row
+    :param end: <int> end data row, default=None
+    :param constant_memory: <bool> stream the report to disk row by row
+    :param cache_dir: <str> directory of the parsed-column cache, default=None disables it
+    :param trim_rule: <TrimRule> windowing the selected specs, default=None
+    :param loss: <str> loss function of the curve fits
+    :param outlier_rule: <OutlierRule> rejecting spikes before the fits, default=None
+    :param segment_rule: <SegmentRule> windowing every spec to its test segment, default=None
+    :return: <dict> per-file status: file, output, status, message, n_specs, n_failed, n_rejected (outlier
+             samples) & stage timings (s)
+    """
+    log = logging.getLogger('status')
+    output = os.path.join(out_dir, report_name(file))
+    status = {'file': file, 'output': output, 'status': 'ok', 'message': '', 'n_specs': 0, 'n_failed': 0,
+              'n_rejected': 0, 'read': 0.0, 'classify': 0.0, 'write': 0.0, 'total': 0.0}
+
+    t0 = time.perf_counter()
+    try:
+        data, order = read_file(file, start, log, end, cache_dir)
+        t1 = time.perf_counter()
+        specs = apt.classify_data(data, log, sg.windows(data, log, segment_rule, trim_rule), loss, outlier_rule)
+        t2 = time.perf_counter()
+        wx.write_xlsx(specs, order, data, log, file=output, constant_memory=constant_memory)
+        t3 = time.perf_counter()
+
+        status['n_specs'] = len(specs)
+        status['n_failed'] = sum(not spec.fit.success for spec in specs)
+        status['n_rejected'] = sum(int(spec.rejected.sum()) for spec in specs)
+        status['read'], status['classify'], status['write'] = t1 - t0, t2 - t1, t3 - t2
+    except Exception as e:
+        status['status'] = 'error'
+        status['message'] = '{}: {}'.format(type(e).__name__, e)
+
+    status['total'] = time.perf_counter() - t0
+    return status
+
+
+def run_batch(files, out_dir, log, start=0, end=None, workers=None, constant_memory=False, cache_dir=None,
+              trim_rule=None, loss='linear', outlier_rule=None, segment_rule=None):
+    """
+    Fans the files out across a process pool, one file per task.
+
+    :param files: <list> of raw test file paths
+    :param out_dir: <str> directory to write the reports to
+    :param log: <Logger>
+    :param start: <int> first data row, applied to every file
+    :param end: <int> end data row, applied to every file, default=None
+    :param workers: <int> number of worker processes, default=None uses os.cpu_count()
+    :param constant_memory: <bool> stream each report to disk row by row
+    :param cache_dir: <str> directory of the parsed-column cache, default=None disables it
+    :param trim_rule: <TrimRule> windowing the selected specs of every file, default=None
+    :param loss: <str> loss function of the curve fits
+    :param outlier_rule: <OutlierRule> rejecting spikes before the fits of every file, default=None
+    :param segment_rule: <SegmentRule> windowing every spec of every file to its test segment, default=None
+    :return: <list> of per-file status <dict>, in the order of files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    log.info('-'*75)
+    log.info('batch: {} file(s) -> "{}", workers: {}'.format(len(files), out_dir, workers or os.cpu_count()))
+
+    t0 = time.perf_counter()
+    results = dict()
+    # workers log through a queue to this process's handlers instead of writing the log file themselves
+    with ProcessPoolExecutor(max_workers=workers, initializer=apt_logger.init_worker,
+                             initargs=(apt_logger.worker_queue(),)) as pool:
+        futures = {pool.submit(process_file, file, out_dir, start, end, constant_memory, cache_dir,
+                               trim_rule, loss, outlier_rule, segment_rule): file for file in files}
+        for future in as_completed(futures):
+            status = future.result()
+            results[futures[future]] = status
+            if status['status'] == 'ok':
+                log.info('  [ok] {} -> {} ({} specs, {} failed fits, {} outliers) in {:.3f}s '
+                         '(read {:.3f}s, classify {:.3f}s, write {:.3f}s)'.format(
+                             status['file'], status['output'], status['n_specs'], status['n_failed'],
+                             status['n_rejected'],
+                             status['total'], status['read'], status['classify'], status['write']))
+            else:
+                log.error('  [error] {}: {} after {:.3f}s'.format(status['file'], status['message'], status['total']))
+
+    n_errors = sum(status['status'] != 'ok' for status in results.values())
+    log.info('batch finished: {} ok, {} error(s) in {:.3f}s'.format(
+        len(files) - n_errors, n_errors, time.perf_counter() - t0))
+    log.info('-'*75)
+    return [results[file] for file in files]
@@ -0,0 +1,200 @@
+import zlib
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src import exp_fit
+
+# upper bound on the elements of one resampled pressure matrix (n_refits x n_samples), ~32 MB
+CHUNK_ELEMENTS = 1 << 22
+HOURS_PER_DAY = 24
+HOURS_PER_MONTH = 365.25 * HOURS_PER_DAY / 12
+
+
+class BootstrapResult:
+    def __init__(self, samples, n_failed, conf=exp_fit.CONFIDENCE):
+        """
+        Refitted parameters of a residual bootstrap.
+
+        :param samples: <ndarray> (n_ok, 3) refitted [a, b, c], one row per successful refit
+        :param n_failed: <int> number of refits that didn't converge (left out of samples)
+        :param conf: <float> confidence level of the percentile intervals
+        """
+        self.samples = samples
+        self.n_failed = n_failed
+        self.conf = conf
+
+    @property
+    def n(self):
+        return len(self.samples)
+
+    def percentiles(self, values):
+        """
+        :param values: <ndarray> (n_ok, ...) a quantity per refit
+        :return: lower, upper <ndarray> percentile interval over the refits
+        """
+        alpha = 1 - self.conf
+        if not len(values):
+            nan = np.full(np.shape(values)[1:], np.nan)
+            return nan, nan
+        lower, upper = np.percentile(values, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        return lower, upper
+
+    @property
+    def intervals(self):
+        """
+        :return: <dict> of 'a', 'b' & 'c': (lower, upper) percentile interval
+        """
+        lower, upper = self.percentiles(self.samples)
+        return {name: (lower[i], upper[i]) for i, name in enumerate(('a', 'b', 'c'))}
+
+    def projected_pressure(self, months=0, days=0, hours=0):
+        """
+        :param months: <float> months after the test start
+        :param days: <float> days after the test start
+        :param hours: <float> hours after the test start
+        :return: lower, upper percentile interval of the pressure (PSI) the curve projects to at that time
+        """
+        t = projection_hours(months, days, hours)
+        a, b, c = self.samples.T
+        return self.percentiles(exp_fit.exp_model(t, a, b, c))
+
+    def __repr__(self):
+        return 'BootstrapResult(n={}, n_failed={}, conf={}, intervals={})'.format(
+            self.n, self.n_failed, self.conf,
+            {name: (round(float(lower), 6), round(float(upper), 6)) for name, (lower, upper) in self.intervals.items()})
+
+
+def projection_hours(months=0, days=0, hours=0):
+    """
+    :return: <float> hours, with a month of 1/12 of a mean year
+    """
+    return months * HOURS_PER_MONTH + days * HOURS_PER_DAY + hours
+
+
+def spec_seed(seed, name):
+    """
+    The seed of one spec's bootstrap, derived from the run's seed and the spec name, so a spec draws
+    the same refits whether it's bootstrapped alone (AptSpec.bootstrap) or with its test (bootstrap_specs)
+
+    :param seed: <int> random seed, None for fresh entropy
+    :param name: <str> spec name
+    :return: <SeedSequence>
+    """
+    if seed is None:
+        return np.random.SeedSequence()
+    return np.random.SeedSequence(seed, spawn_key=(zlib.crc32(name.encode()),))
+
+
+def refit_chunk(t, curve, residuals, popt, n, seed, loss='linear', weights=None):
+    """
+    Resamples the residuals with replacement onto the fitted curve, n times, and refits the synthetic
+    tests warm-started from the original fit, with the same loss & weights. Plain least squares fits
+    all n together with exp_fit.fit_batch(), a robust loss or weights go through exp_fit.fit() one by one.
+
+    :param t: <ndarray> time (hours)
+    :param curve: <ndarray> fitted pressure at t
+    :param residuals: <ndarray> residuals of the original fit
+    :param popt: <ndarray> original [a, b, c]
+    :param n: <int> number of refits
+    :param seed: <SeedSequence> seed of this chunk
+    :param loss: <str> loss of the original fit, see exp_fit.LOSSES
+    :param weights: <ndarray> per-sample weights of the original fit, default=None
+    :return: <ndarray> (n, 3) refitted [a, b, c], NaN rows for refits that didn't converge
+    """
+    rng = np.random.default_rng(seed)
+    p = curve + residuals[rng.integers(0, len(residuals), size=(n, len(residuals)))]
+    if loss == 'linear' and weights is None:
+        results = exp_fit.fit_batch(t, p, p0=np.tile(popt, (n, 1)))
+    else:
+        results = [exp_fit.fit(t, row, p0=popt, loss=loss, weights=weights) for row in p]
+    return np.array([result.popt if result.success else np.full(3, np.nan) for result in results])
+
+
+def chunk_args(t, p, result, n, seed, loss='linear', weights=None):
+    """
+    Splits n refits into chunks small enough to resample in memory; each chunk gets its own seed
+    spawned from seed, so the outcome doesn't depend on how the chunks are scheduled.
+
+    :param seed: <int> or <SeedSequence> random seed
+    :param loss: <str> loss of the original fit
+    :param weights: <ndarray> per-sample weights of the original fit, default=None
+    :return: <list> of refit_chunk() argument tuples, empty if the fit can't be bootstrapped
+    """
+    t = np.asarray(t, dtype=np.float64)
+    if not result.success or len(t) < 4:
+        return []
+
+    residuals = result.residuals
+    curve = np.asarray(p, dtype=np.float64) - residuals
+    size = max(1, min(n, CHUNK_ELEMENTS // len(t)))
+    sizes = [min(size, n - i) for i in range(0, n, size)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+    return [(t, curve, residuals, result.popt, m, s, loss, weights) for m, s in zip(sizes, seeds)]
+
+
+def run_chunks(args, workers=None):
+    """
+    :param args: <list> of refit_chunk() argument tuples
+    :param workers: <int> worker processes, default=None refits in-process
+    :return: <list> of refit_chunk() results, in the order of args
+    """
+    if workers and workers > 1 and len(args) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(refit_chunk, *zip(*args)))
+    return [refit_chunk(*arg) for arg in args]
+
+
+def collect(chunks, n, conf):
+    """
+    :return: <BootstrapResult> of the refitted chunks, failed refits counted and left out
+    """
+    if not chunks:
+        return BootstrapResult(np.empty((0, 3)), n, conf)
+    samples = np.concatenate(chunks)
+    ok = np.all(np.isfinite(samples), axis=1)
+    return BootstrapResult(samples[ok], int(np.sum(~ok)), conf)
+
+
+def bootstrap(t, p, result, n=1000, conf=exp_fit.CONFIDENCE, seed=None, workers=None, loss='linear',
+              weights=None):
+    """
+    Residual bootstrap of a decay fit.
+
+    :param t: <ndarray> time (hours)
+    :param p: <ndarray> normalized pressure (PSI)
+    :param result: <FitResult> fit of p
+    :param n: <int> number of refits
+    :param conf: <float> confidence level of the percentile intervals
+    :param seed: <int> or <SeedSequence> random seed, default=None
+    :param workers: <int> worker processes for the chunks, default=None refits in-process
+    :param loss: <str> loss of the original fit, the refits use the same
+    :param weights: <ndarray> per-sample weights of the original fit, default=None
+    :return: <BootstrapResult>
+    """
+    return collect(run_chunks(chunk_args(t, p, result, n, seed, loss, weights), workers), n, conf)
+
+
+def bootstrap_specs(specs, n=1000, conf=exp_fit.CONFIDENCE, seed=None, workers=None):
+    """
+    Bootstraps every spec of a test, the chunks of all specs share one process pool. The results
+    are cached on the specs like AptSpec.bootstrap(), with the same per-spec seed (see spec_seed()).
+
+    :param specs: <list> of fitted <AptSpec>
+    :param n: <int> number of refits per spec
+    :param conf: <float> confidence level of the percentile intervals
+    :param seed: <int> random seed, default=None
+    :param workers: <int> worker processes, default=None refits in-process
+    :return: <list> of <BootstrapResult>, in the order of specs
+    """
+    args = [chunk_args(spec.valid_time, spec.valid_pressure, spec.fit, n, spec_seed(seed, spec.name), spec.loss,
+                       spec.valid_weights) for spec in specs]
+    chunks = iter(run_chunks([arg for spec_args in args for arg in spec_args], workers))
+
+    results = []
+    for spec, spec_args in zip(specs, args):
+        results.append(collect([next(chunks) for _ in spec_args], n, conf))
+        spec._cache[('bootstrap', n, conf, seed)] = results[-1]
+    return results
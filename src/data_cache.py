@@ -0,0 +1,93 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+# bump whenever a reader changes what it parses, so stale caches are never reused
+READER_VERSION = 2
+CACHE_DIR = '.apt_cache'
+CHUNK_SIZE = 1 << 20
+
+
+def file_hash(file):
+    """
+    :param file: <str> path to a raw test file
+    :return: <str> sha1 hex digest of the file contents
+    """
+    digest = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(file, reader, cache_dir=CACHE_DIR):
+    """
+    :param file: <str> path to a raw test file
+    :param reader: <str> name of the reader that parsed it, 'xlsx' or 'csv'
+    :param cache_dir: <str> root directory of the cache
+    :return: <str> directory holding the parsed columns of file
+    """
+    return os.path.join(cache_dir, '{}_{}_v{}'.format(file_hash(file), reader, READER_VERSION))
+
+
+def load(file, reader, cache_dir, log):
+    """
+    :param file: <str> path to a raw test file
+    :param reader: <str> name of the reader, 'xlsx' or 'csv'
+    :param cache_dir: <str> root directory of the cache
+    :param log: <Logger>
+    :return: columns: <dict> of key: full-length read-only <ndarray> backed by a memory map of the
+             cached *.npy, incl. 'datetime'; None on a cache miss
+    :return: specs: <list> of spec keys, in column order
+    :return: params: <list> of param keys
+    """
+    path = cache_path(file, reader, cache_dir)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        # plain ndarray views of the maps: slicing a window reads only the pages it spans, and every
+        # spec of the test shares the one 'datetime' array object
+        columns = {key: np.asarray(np.load(os.path.join(path, name), mmap_mode='r'))
+                   for key, name in meta['columns'].items()}
+    except (OSError, ValueError, KeyError):
+        log.debug('  cache miss: {}'.format(path))
+        return None, None, None
+
+    log.debug('  cache hit: {}'.format(path))
+    return columns, meta['specs'], meta['params']
+
+
+def store(file, reader, columns, specs, params, cache_dir, log):
+    """
+    Writes the parsed columns as one *.npy file each, next to a meta.json with the keys. The entry
+    is assembled in a temporary directory and renamed into place, so concurrent runs on the same
+    file never see a partial entry.
+
+    :param file: <str> path to a raw test file
+    :param reader: <str> name of the reader, 'xlsx' or 'csv'
+    :param columns: <dict> of key: full-length <ndarray>, incl. 'datetime'
+    :param specs: <list> of spec keys, in column order
+    :param params: <list> of param keys
+    :param cache_dir: <str> root directory of the cache
+    :param log: <Logger>
+    """
+    path = cache_path(file, reader, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        names = dict()
+        for j, (key, column) in enumerate(columns.items()):
+            names[key] = 'col{}.npy'.format(j)
+            np.save(os.path.join(tmp, names[key]), np.ascontiguousarray(column))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'source': os.path.basename(file), 'version': READER_VERSION,
+                       'specs': specs, 'params': params, 'columns': names}, f)
+        os.rename(tmp, path)
+        log.debug('  cached: {}'.format(path))
+    except OSError:
+        # another run cached the same file first
+        shutil.rmtree(tmp, ignore_errors=True)
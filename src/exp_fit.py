@@ -0,0 +1,395 @@
+import time
+import numpy as np
+
+from scipy import optimize, special
+
+CONFIDENCE = 0.95
+LOSSES = ('linear', 'soft_l1', 'huber')
+
+# last resort of the fallback chain: a decaying (b >= 0) curve, a & c free
+BOUNDS = ([-np.inf, 0, -np.inf], [np.inf, np.inf, np.inf])
+
+# reasons a fit fails, FitResult.reason
+TOO_FEW_SAMPLES = 'too_few_samples'
+NON_FINITE_DATA = 'non_finite_data'
+SOLVER_ERROR = 'solver_error'
+NO_CONVERGENCE = 'no_convergence'
+DIVERGED = 'diverged'
+SINGULAR_COVARIANCE = 'singular_covariance'
+
+
+class FitResult:
+    def __init__(self, popt, pcov, residuals, status, message='', nfev=0, wall_time=0.0, reason='', stage='',
+                 loss='linear'):
+        """
+        Result of fitting the exponential decay model a*exp(-b*t)+c to one spec.
+
+        :param popt: <ndarray> fitted parameters [a, b, c]
+        :param pcov: <ndarray> 3x3 covariance of popt
+        :param residuals: <ndarray> pressure - model(time), one per sample
+        :param status: <str> 'success' or 'failed'
+        :param message: <str> solver message or the reason the fit failed
+        :param nfev: <int> number of model evaluations used by the solver
+        :param wall_time: <float> seconds spent in the solver
+        :param reason: <str> why the fit failed, one of the reason constants, '' on success
+        :param stage: <str> the solver stage that produced the fit: 'batch', 'lm', 'trf' or 'bounded_trf'
+        :param loss: <str> loss function of the fit, one of LOSSES
+        """
+        self.popt = np.asarray(popt, dtype=np.float64)
+        self.pcov = np.asarray(pcov, dtype=np.float64)
+        self.residuals = np.asarray(residuals, dtype=np.float64)
+        self.status = status
+        self.message = message
+        self.nfev = nfev
+        self.wall_time = wall_time
+        self.reason = reason
+        self.stage = stage
+        self.loss = loss
+
+    @property
+    def success(self):
+        return self.status == 'success'
+
+    @property
+    def perr(self):
+        """
+        :return: <ndarray> one standard error per parameter, sqrt(diag(pcov))
+        """
+        return np.sqrt(np.diag(self.pcov))
+
+    @property
+    def dof(self):
+        return len(self.residuals) - len(self.popt)
+
+    @property
+    def residual_variance(self):
+        """
+        :return: <float> s^2 = sum(residuals^2) / (n - 3), the variance of a single measurement
+        """
+        return np.sum(self.residuals ** 2) / max(self.dof, 1)
+
+    def __repr__(self):
+        return 'FitResult(status={}, stage={}, loss={}, reason={}, popt={}, nfev={}, wall_time={:.4f})'.format(
+            self.status, self.stage or '-', self.loss, self.reason or '-', self.popt, self.nfev, self.wall_time)
+
+
+def exp_model(t, a, b, c):
+    return a * np.exp(-b * t) + c
+
+
+def exp_jacobian(t, a, b, c):
+    """
+    Closed-form partial derivatives of exp_model() w.r.t. a, b & c
+    :return: <ndarray> (n_samples, 3) jacobian
+    """
+    e = np.exp(-b * t)
+    return np.stack([e, -a * t * e, np.ones_like(t)], axis=-1)
+
+
+def loss_rate(popt, t):
+    """
+    :param popt: <ndarray> fitted [a, b, c]
+    :param t: <float> or <ndarray> time (hours)
+    :return: pressure loss per hour (PSI/hr) of the fitted curve at t, -d/dt a*exp(-b*t)+c
+    """
+    a, b, c = popt
+    return a * b * np.exp(-b * t)
+
+
+def initial_guess(t, p):
+    """
+    Three-point estimate of [a, b, c] from the start, middle and end of the data. Each point is the
+    median of a short neighbourhood so a single noisy sample doesn't throw the estimate off. Flat,
+    rising or too-short data falls back to a decay with a time constant of the test length.
+
+    :param t: <ndarray> time (hours), sorted
+    :param p: <ndarray> normalized pressure (PSI)
+    :return: <ndarray> p0 = [a, b, c]
+    """
+    n = len(t)
+    span = t[-1] - t[0] if n else 0
+    if n < 3 or span <= 0:
+        return np.array([0, 0, p[0] if n else 0], dtype=np.float64)
+
+    k = max(1, n // 20)
+    mid = min(max(int(np.searchsorted(t, t[0] + span / 2)), k), n - k)
+    lo, hi = mid - k // 2, mid - k // 2 + k
+
+    t0, y0 = np.mean(t[:k]), np.median(p[:k])
+    t1, y1 = np.mean(t[lo:hi]), np.median(p[lo:hi])
+    t2, y2 = np.mean(t[-k:]), np.median(p[-k:])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = (y2 - y1) / (y1 - y0)
+        b = -np.log(r) / ((t2 - t0) / 2)
+        a = (y1 - y0) / (np.exp(-b * t1) - np.exp(-b * t0))
+        c = y0 - a * np.exp(-b * t0)
+
+    if not (0 < r < 1 and np.all(np.isfinite([a, b, c]))):
+        b = 1 / span
+        a = (y0 - y2) / (1 - np.exp(-b * span))
+        c = y0 - a
+
+    return np.array([a, b, c], dtype=np.float64)
+
+
+def bands(result, t, conf=CONFIDENCE):
+    """
+    Delta-method bands of the fitted curve: the variance of the model at t is J(t) pcov J(t)', with
+    J the jacobian at popt. The confidence band covers the curve itself, the prediction band a new
+    measurement, which adds the residual variance. Both are +/- the Student-t quantile for n - 3
+    degrees of freedom, evaluated for every point of t at once.
+
+    :param result: <FitResult>
+    :param t: <ndarray> time (hours) to evaluate the bands at
+    :param conf: <float> confidence level, default=0.95
+    :return: <dict> of 'fit', 'confidence' & 'prediction'; the curve and (lower, upper) <ndarray> pairs
+    """
+    t = np.asarray(t, dtype=np.float64)
+    if not result.success or result.dof < 1:
+        nan = np.full(len(t), np.nan)
+        return {'fit': nan, 'confidence': (nan, nan), 'prediction': (nan, nan)}
+
+    jac = exp_jacobian(t, *result.popt)
+    variance = np.einsum('ni,ni->n', jac @ result.pcov, jac)
+    q = special.stdtrit(result.dof, 1 - (1 - conf) / 2)
+    curve = exp_model(t, *result.popt)
+    ci = q * np.sqrt(np.maximum(variance, 0))
+    pi = q * np.sqrt(np.maximum(variance, 0) + result.residual_variance)
+    return {'fit': curve, 'confidence': (curve - ci, curve + ci), 'prediction': (curve - pi, curve + pi)}
+
+
+def noise_scale(p):
+    """
+    Robust estimate of the measurement noise from successive differences (1.4826 * MAD / sqrt(2)),
+    the scale at which the robust losses start to down-weight residuals.
+
+    :param p: <ndarray> normalized pressure (PSI)
+    :return: <float> noise sigma (PSI), 1.0 if it can't be estimated
+    """
+    diff = np.diff(p)
+    if not len(diff):
+        return 1.0
+    scale = 1.4826 * np.median(np.abs(diff - np.median(diff))) / np.sqrt(2)
+    return scale if np.isfinite(scale) and scale > 0 else 1.0
+
+
+def fit(t, p, p0=None, loss='linear', weights=None, f_scale=None):
+    """
+    Fits the decay model through a fallback chain; each stage starts from the analytic seed:
+      1. Levenberg-Marquardt ('lm'), or for a robust loss an unbounded trust region reflective ('trf')
+      2. trust region reflective bounded to a decaying curve ('bounded_trf')
+    A stage fails when the solver errors, doesn't converge, diverges or leaves a singular covariance;
+    the returned FitResult carries the reason of the last stage and the messages of all stages.
+
+    :param t: <ndarray> time (hours)
+    :param p: <ndarray> normalized pressure (PSI)
+    :param p0: <ndarray> initial [a, b, c], default=None uses initial_guess()
+    :param loss: <str> one of LOSSES; 'soft_l1' & 'huber' limit the pull of outliers
+    :param weights: <ndarray> per-sample weights (e.g. 1/variance, 0 drops a sample), default=None
+    :param f_scale: <float> residual (PSI) where the robust losses kick in, default=None uses noise_scale()
+    :return: <FitResult>
+    """
+    t0 = time.perf_counter()
+    if loss not in LOSSES:
+        raise ValueError('loss must be one of {}, given: "{}"'.format(LOSSES, loss))
+    t = np.asarray(t, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+    sqrt_w = np.ones_like(p) if weights is None else np.sqrt(np.asarray(weights, dtype=np.float64))
+
+    def failed(reason, message, nfev=0):
+        return FitResult(np.zeros(3), np.zeros((3, 3)),
+                         residuals=np.full(len(p), np.nan),
+                         status='failed',
+                         message=message,
+                         nfev=nfev,
+                         wall_time=time.perf_counter() - t0,
+                         reason=reason,
+                         loss=loss)
+
+    if np.count_nonzero(sqrt_w) < 4 or len(t) != len(p):
+        return failed(TOO_FEW_SAMPLES, '{} weighted samples, the model needs more than 3'.format(
+            np.count_nonzero(sqrt_w)))
+    if not (np.all(np.isfinite(t)) and np.all(np.isfinite(p)) and np.all(np.isfinite(sqrt_w))):
+        return failed(NON_FINITE_DATA, 'time, pressure or weights contain NaN/INF')
+
+    if p0 is None:
+        p0 = initial_guess(t, p)
+    p0 = np.asarray(p0, dtype=np.float64)
+    if f_scale is None:
+        f_scale = noise_scale(p)
+
+    def residuals(x):
+        return sqrt_w * (exp_model(t, *x) - p)
+
+    def jacobian(x):
+        return sqrt_w[:, None] * exp_jacobian(t, *x)
+
+    if loss == 'linear':
+        stages = [('lm', {'method': 'lm'})]
+    else:
+        stages = [('trf', {'method': 'trf', 'loss': loss, 'f_scale': f_scale})]
+    stages.append(('bounded_trf', {'method': 'trf', 'loss': loss, 'f_scale': f_scale, 'bounds': BOUNDS,
+                                   'x_scale': 'jac'}))
+
+    messages = []
+    reason = ''
+    nfev = 0
+    for stage, options in stages:
+        start = np.clip(p0, BOUNDS[0], BOUNDS[1]) if 'bounds' in options else p0
+        try:
+            with np.errstate(over='ignore', invalid='ignore'):
+                result = optimize.least_squares(residuals, start, jac=jacobian, **options)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            reason = SOLVER_ERROR
+            messages.append('{}: {}'.format(stage, e))
+            continue
+
+        nfev += result.nfev
+        popt = result.x
+        with np.errstate(over='ignore', invalid='ignore'):
+            fitted = exp_model(t, *popt)
+        if not result.success:
+            reason = NO_CONVERGENCE
+        elif not (np.all(np.isfinite(popt)) and np.all(np.isfinite(fitted))):
+            reason = DIVERGED
+        else:
+            weighted = sqrt_w * (p - fitted)
+            dof = max(np.count_nonzero(sqrt_w) - len(popt), 1)
+            jtj = result.jac.T @ result.jac
+            if np.linalg.matrix_rank(jtj) < len(popt):
+                reason = SINGULAR_COVARIANCE
+            else:
+                return FitResult(popt, np.linalg.inv(jtj) * np.sum(weighted ** 2) / dof,
+                                 residuals=p - fitted,
+                                 status='success',
+                                 message=result.message,
+                                 nfev=nfev,
+                                 wall_time=time.perf_counter() - t0,
+                                 stage=stage,
+                                 loss=loss)
+        messages.append('{}: {} ({})'.format(stage, reason, result.message))
+
+    return failed(reason, '; '.join(messages), nfev)
+
+
+def fit_batch(t, p, p0=None, max_iter=200, ftol=1.49012e-08, xtol=1.49012e-08):
+    """
+    Fits every row of a pressure matrix that shares one time axis together. A Levenberg-Marquardt
+    step is taken for all specs at once: J'J and J'r of the decay model are built from a handful of
+    time-weighted sums of exp(-b*t) (matrix-vector products over the shared time axis), and the
+    3x3 systems are solved batched. Specs drop out of the update as they converge. A spec that
+    doesn't converge or leaves a singular covariance is returned as failed, like fit() does, so the
+    caller can refit it through fit()'s fallback chain.
+
+    :param t: <ndarray> (n_samples,) shared time (hours)
+    :param p: <ndarray> (n_specs, n_samples) normalized pressure (PSI)
+    :param p0: <ndarray> (n_specs, 3) initial [a, b, c], default=None uses initial_guess() per spec
+    :param max_iter: <int> maximum number of LM iterations
+    :param ftol: <float> relative change of the sum of squares to stop at
+    :param xtol: <float> relative step size to stop at
+    :return: <list> of <FitResult>, one per row of p; wall_time is the batch time split evenly
+    """
+    t0 = time.perf_counter()
+    t = np.asarray(t, dtype=np.float64)
+    p = np.atleast_2d(np.asarray(p, dtype=np.float64))
+    m, n = p.shape
+    if p0 is None:
+        p0 = np.array([initial_guess(t, row) for row in p])
+    x = np.array(p0, dtype=np.float64).reshape(m, 3)
+    powers = np.stack([np.ones_like(t), t, t * t], axis=1)
+
+    def evaluate(params, rows):
+        e = np.exp(-params[:, 1, None] * t)
+        r = p[rows] - (params[:, 0, None] * e + params[:, 2, None])
+        return e, r, np.einsum('mn,mn->m', r, r)
+
+    def normal_equations(params, e, r):
+        a = params[:, 0]
+        e2 = (e * e) @ powers           # sum(e^2), sum(t*e^2), sum(t^2*e^2)
+        e1 = e @ powers[:, :2]          # sum(e), sum(t*e)
+        er = (e * r) @ powers[:, :2]    # sum(e*r), sum(t*e*r)
+        jtj = np.empty((len(a), 3, 3))
+        jtj[:, 0, 0] = e2[:, 0]
+        jtj[:, 0, 1] = jtj[:, 1, 0] = -a * e2[:, 1]
+        jtj[:, 0, 2] = jtj[:, 2, 0] = e1[:, 0]
+        jtj[:, 1, 1] = a * a * e2[:, 2]
+        jtj[:, 1, 2] = jtj[:, 2, 1] = -a * e1[:, 1]
+        jtj[:, 2, 2] = n
+        jtr = np.stack([er[:, 0], -a * er[:, 1], r.sum(axis=1)], axis=1)
+        return jtj, jtr
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        rows = np.arange(m)
+        e, r, cost = evaluate(x, rows)
+        lam = np.full(m, 1e-3)
+        active = np.isfinite(cost)
+        converged = np.zeros(m, dtype=bool)
+        nfev = np.ones(m, dtype=int)
+
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            idx = np.flatnonzero(active)
+            jtj, jtr = normal_equations(x[idx], e[idx], r[idx])
+            diag = np.einsum('mii->mi', jtj)
+            damped = jtj + (lam[idx, None] * (diag + 1e-12))[:, :, None] * np.eye(3)
+            try:
+                step = np.linalg.solve(damped, jtr[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                # solve the specs one by one, a singular system gets a NaN step: it is rejected and
+                # the damping grows until the system is solvable or the spec gives up
+                step = np.full((len(idx), 3), np.nan)
+                for k in range(len(idx)):
+                    try:
+                        step[k] = np.linalg.solve(damped[k], jtr[k])
+                    except np.linalg.LinAlgError:
+                        pass
+
+            trial = x[idx] + step
+            e_trial, r_trial, cost_trial = evaluate(trial, idx)
+            nfev[idx] += 1
+
+            better = np.isfinite(cost_trial) & (cost_trial <= cost[idx])
+            flat = np.abs(cost[idx] - cost_trial) <= ftol * cost[idx]
+            small_x = np.all(np.abs(step) <= xtol * (np.abs(x[idx]) + xtol), axis=1)
+
+            accept = idx[better]
+            x[accept] = trial[better]
+            e[accept] = e_trial[better]
+            r[accept] = r_trial[better]
+            cost[accept] = cost_trial[better]
+            lam[accept] = np.maximum(lam[accept] / 10, 1e-12)
+            lam[idx[~better]] *= 10
+
+            # only an accepted step can end the fit, a rejected one at high damping is just small
+            done = idx[better & (flat | small_x)]
+            converged[done] = True
+            active[done] = False
+            active[idx[lam[idx] > 1e16]] = False
+
+        jtj, jtr = normal_equations(x, e, r)
+        finite = np.all(np.isfinite(jtj), axis=(1, 2)) & np.all(np.isfinite(x), axis=1)
+        regular = np.zeros(m, dtype=bool)
+        regular[finite] = np.linalg.matrix_rank(jtj[finite]) == 3
+        pcov = np.zeros((m, 3, 3))
+        pcov[regular] = np.linalg.inv(jtj[regular]) * (cost[regular] / max(n - 3, 1))[:, None, None]
+
+    wall_time = (time.perf_counter() - t0) / max(m, 1)
+    results = []
+    for i in range(m):
+        if converged[i] and regular[i]:
+            results.append(FitResult(x[i], pcov[i], r[i], status='success',
+                                     message='converged in batch of {}'.format(m),
+                                     nfev=int(nfev[i]), wall_time=wall_time, stage='batch'))
+        elif converged[i]:
+            results.append(FitResult(np.zeros(3), np.zeros((3, 3)), np.full(n, np.nan), status='failed',
+                                     message='batch fit left a singular covariance',
+                                     nfev=int(nfev[i]), wall_time=wall_time, reason=SINGULAR_COVARIANCE,
+                                     stage='batch'))
+        else:
+            results.append(FitResult(np.zeros(3), np.zeros((3, 3)), np.full(n, np.nan), status='failed',
+                                     message='batch fit did not converge in {} iterations'.format(max_iter),
+                                     nfev=int(nfev[i]), wall_time=wall_time, reason=NO_CONVERGENCE,
+                                     stage='batch'))
+    return results
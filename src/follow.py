@@ -0,0 +1,170 @@
+import io
+import csv
+import time
+import itertools
+
+from src import read_csv as rc
+from src import AptSpec as apt
+from src import exp_fit
+from src import write_sidecar as ws
+from src import segment as sg
+
+
+class CsvFollower:
+    def __init__(self, file):
+        """
+        Tails a logger *.csv export that is still being written. Every poll() parses only the
+        complete lines appended since the previous one.
+
+        :param file: <str> path to the *.csv file
+        """
+        self.file = file
+        self.offset = 0
+        self.keys = None
+        self.specs = None
+        self.params = None
+
+    def poll(self, log):
+        """
+        :param log: <Logger>
+        :return: <dict> of spec key: AptSpec kwargs of the new rows (see format_data_dict()), None if
+                 no complete row was added since the last poll
+        """
+        with open(self.file, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read()
+
+        # a row that is still being written is left for the next poll
+        end = chunk.rfind(b'\n') + 1
+        if not end:
+            return None
+        self.offset += end
+        reader = csv.reader(io.StringIO(chunk[:end].decode('latin-1'), newline=''))
+
+        if self.keys is None:
+            header, first = rc.read_header(reader)
+            self.keys, self.specs, self.params = rc.read_header_keys(header)
+            reader = itertools.chain([first], reader)
+
+        columns = rc.read_body(reader, self.keys)
+        if not len(columns['datetime']):
+            return None
+        log.debug('follow: {} new row(s) from "{}"'.format(len(columns['datetime']), self.file))
+        return rc.format_data_dict(self.specs, self.params, columns, log)[0]
+
+
+def follow(file, log, interval=60.0, start=0, loss='linear', polls=None, sidecar=None, outlier_rule=None,
+           segment_rule=None, end=None, trim_rule=None):
+    """
+    Follows a live test: polls the growing *.csv every interval seconds, appends the new rows to the
+    specs and refits them warm-started from the previous parameters. Runs until interrupted (Ctrl+C)
+    or for a number of polls.
+
+    :param file: <str> path to the *.csv file
+    :param log: <Logger>
+    :param interval: <float> seconds between polls
+    :param start: <int> first data row to analyze
+    :param end: <int> data row to stop analyzing at (exclusive), default=None follows every new row
+    :param loss: <str> loss function of the curve fits, see exp_fit.LOSSES
+    :param polls: <int> number of polls to run, default=None runs until interrupted
+    :param sidecar: <str> *.json or *.csv sidecar to refresh after every refit, default=None
+    :param outlier_rule: <OutlierRule> rejecting spikes before every refit, default=None
+    :param segment_rule: <SegmentRule> re-finding the test segment of every spec every poll, default=None
+    :param trim_rule: <TrimRule> windowing the selected specs every poll, overrides their segment, default=None
+    :raises ValueError: if a trim_rule label or sample # matches none of the specs
+    :return: specs: <list> of the latest fitted <AptSpec>, None if no row was read
+    :return: order: <list> of spec keys, in column order
+    """
+    follower = CsvFollower(file)
+    specs = None
+    windows = None
+    log.info('-'*75)
+    log.info('follow: "{}" every {}s, Ctrl+C to stop'.format(file, interval))
+
+    try:
+        for i in itertools.count():
+            if polls is not None and i >= polls:
+                break
+            if i:
+                time.sleep(interval)
+
+            data = follower.poll(log)
+            if not data:
+                continue
+
+            if specs is None:
+                if trim_rule:
+                    trim_rule.check(follower.specs)
+                specs = [apt.AptSpec(key, **data[key]) for key in follower.specs]
+                for spec in specs:
+                    spec.set_fit_options(loss=loss)
+                    spec.set_outlier_rule(outlier_rule)
+            else:
+                apt.append_specs(specs, data)
+            windows = set_windows(specs, log, start, end, segment_rule, trim_rule, windows)
+            if not any(len(spec.datetime) for spec in specs):
+                continue
+
+            t0 = time.perf_counter()
+            apt.fit_specs(specs)
+            log_status(specs, time.perf_counter() - t0, log)
+            if sidecar:
+                ws.write_sidecar(specs, sidecar, log)
+    except KeyboardInterrupt:
+        log.info('follow: stopped')
+
+    return specs, follower.specs
+
+
+def set_windows(specs, log, start=0, end=None, segment_rule=None, trim_rule=None, previous=None):
+    """
+    Windows every spec after a poll: [start:end], or its test segment, or the [--trim] window of the
+    specs the trim_rule selects, both kept within [start:end] like the rows read_csv() returns. A trim
+    window the live test hasn't reached yet is left for a later poll.
+
+    :param specs: <list> of <AptSpec>
+    :param log: <Logger>
+    :param previous: <dict> the windows of the previous poll, the segments are logged again when one changed
+    :return: <dict> of spec name: (start, end) window
+    """
+    def clip(lo, hi):
+        if end is not None:
+            hi = end if hi is None else min(hi, end)
+        return max(lo, start), hi
+
+    windows = {spec.name: (start, end) for spec in specs}
+    if segment_rule:
+        segments = segment_rule.resolve_specs(specs)
+        windows.update((name, clip(result.start, result.end)) for name, result in segments.items())
+        if previous is None or any(windows[name] != previous.get(name) for name in segments):
+            sg.log_report([spec.name for spec in specs], segments, log)
+    if trim_rule:
+        for spec in specs:
+            if trim_rule.selects(spec.name):
+                try:
+                    trim = trim_rule.window(spec._datetime)
+                except ValueError:
+                    continue
+                windows[spec.name] = clip(trim.start, trim.end)
+
+    for spec in specs:
+        spec.set_window(*windows[spec.name])
+    return windows
+
+
+def log_status(specs, wall_time, log):
+    """
+    :param specs: <list> of fitted <AptSpec>
+    :param wall_time: <float> seconds spent refitting
+    :param log: <Logger>
+    """
+    log.info('follow: {} samples, refit in {:.3f}s'.format(len(specs[0].psi) if specs else 0, wall_time))
+    for spec in specs:
+        fit = spec.fit
+        if not fit.success:
+            log.warning('  "{}" curve_fit failed ({}): {}'.format(spec.name, fit.reason, fit.message))
+            continue
+        t = spec.time[-1]
+        log.info('  "{}" a={:.4f} b={:.6f} c={:.4f}, loss/hr {:.5f} PSI at {:.2f} h ({} nfev, {})'.format(
+            spec.name, fit.popt[0], fit.popt[1], fit.popt[2], exp_fit.loss_rate(fit.popt, t), t, fit.nfev,
+            fit.stage))
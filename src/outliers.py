@@ -0,0 +1,207 @@
+import os
+import csv
+import numpy as np
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+# consistency constant of the MAD for normally distributed noise
+MAD_SIGMA = 1.4826
+# upper bound on the elements of one chunk of rolling windows (n_specs x n_windows x window), ~32 MB
+CHUNK_ELEMENTS = 1 << 22
+REPORT_FIELDS = ('spec', 'sample', 'datetime', 'psi', 'pressure', 'median', 'deviation', 'threshold')
+
+
+class OutlierRule:
+    def __init__(self, window=11, k=5.0, min_deviation=0.05):
+        """
+        Rejects spikes before fitting: a sample is an outlier when it is further than k scaled MADs
+        from the median of the window of samples around it. The median follows steps and steep
+        decays, so only isolated glitches are rejected. The MAD of a short window is a noisy
+        estimate, so it is floored by the noise level of the whole spec (see noise_scale()).
+
+        :param window: <int> samples per rolling window, odd
+        :param k: <float> threshold in scaled MADs (~ standard deviations of the noise)
+        :param min_deviation: <float> smallest deviation (PSI) counted as an outlier, keeps flat
+                              stretches with a MAD of ~0 from rejecting every quantization step
+        """
+        if window < 3 or not window % 2:
+            raise ValueError('outlier window must be an odd number of samples >= 3, given: {}'.format(window))
+        self.window = int(window)
+        self.k = float(k)
+        self.min_deviation = float(min_deviation)
+
+    def __repr__(self):
+        return 'OutlierRule(window={}, k={}, min_deviation={})'.format(self.window, self.k, self.min_deviation)
+
+    def key(self):
+        return self.window, self.k, self.min_deviation
+
+    def detect(self, values, valid=None):
+        """
+        :param values: <ndarray> (n_specs, n_samples) pressures of specs sharing a time axis
+        :param valid: <ndarray> of <bool> like values, samples to consider, default=None uses the finite ones
+        :return: rejected: <ndarray> of <bool> like values, True for the outliers
+        :return: median, threshold: <ndarray> like values, rolling median & rejection threshold
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        valid = np.isfinite(values) if valid is None else np.atleast_2d(valid) & np.isfinite(values)
+        filled = fill_invalid(values, valid)
+
+        median, mad = rolling_median_mad(filled, self.window)
+        scale = np.maximum(MAD_SIGMA * mad, noise_scale(filled)[:, None])
+        threshold = np.maximum(self.k * scale, self.min_deviation)
+        rejected = valid & (np.abs(filled - median) > threshold)
+        return rejected, median, threshold
+
+
+def fill_invalid(values, valid):
+    """
+    :return: <ndarray> values with the invalid samples interpolated from their valid neighbours, so
+             they don't disturb the rolling windows
+    """
+    if valid.all():
+        return values
+    filled = values.copy()
+    index = np.arange(values.shape[1])
+    for i in np.flatnonzero(~valid.all(axis=1)):
+        if valid[i].any():
+            filled[i] = np.interp(index, index[valid[i]], values[i, valid[i]])
+        else:
+            filled[i] = 0.0
+    return filled
+
+
+def noise_scale(values):
+    """
+    Robust noise level of every row from its successive differences, like exp_fit.noise_scale(): the
+    smooth decay cancels out in the differences, the noise doesn't (its differences have sqrt(2) x
+    its standard deviation).
+
+    :param values: <ndarray> (n_rows, n_samples), finite
+    :return: <ndarray> (n_rows,) noise standard deviation
+    """
+    if values.shape[1] < 2:
+        return np.zeros(values.shape[0])
+    diff = np.diff(values, axis=1)
+    mad = np.median(np.abs(diff - np.median(diff, axis=1, keepdims=True)), axis=1)
+    return MAD_SIGMA * mad / np.sqrt(2)
+
+
+def rolling_median_mad(values, window):
+    """
+    Rolling median & median absolute deviation of every row, in linear time: the windows are strided
+    views, processed in chunks of CHUNK_ELEMENTS. The first & last window//2 samples are judged by the
+    first & last full window, one-sided, so a glitch in the very first or last sample is still
+    rejected; a genuine level step at the start or end of the data is left to [--segment].
+
+    :param values: <ndarray> (n_rows, n_samples), finite
+    :param window: <int> samples per window, odd
+    :return: median, mad: <ndarray> (n_rows, n_samples) of the window around each sample
+    """
+    rows, n = values.shape
+    if not n:
+        return values.copy(), values.copy()
+    window = min(window, n)
+    starts = n - window + 1
+    median = np.empty((rows, starts))
+    mad = np.empty((rows, starts))
+
+    chunk = max(1, CHUNK_ELEMENTS // (rows * window))
+    for j in range(0, starts, chunk):
+        end = min(j + chunk, starts)
+        windows = sliding_window_view(values[:, j:end + window - 1], window, axis=1)
+        median[:, j:end] = np.median(windows, axis=2)
+        mad[:, j:end] = np.median(np.abs(windows - median[:, j:end, None]), axis=2)
+
+    centered = np.clip(np.arange(n) - window // 2, 0, starts - 1)
+    return median[:, centered], mad[:, centered]
+
+
+def detect_specs(specs):
+    """
+    Runs the OutlierRule of every spec that doesn't have a cached result yet. Specs sharing a time
+    axis, window and rule are stacked and cleaned together. The results are cached on the specs,
+    see AptSpec.rejected.
+
+    :param specs: <list> of <AptSpec>
+    """
+    groups = dict()
+    for spec in specs:
+        if spec.outlier_rule is None or 'rejected' in spec._cache:
+            continue
+        key = (id(spec._datetime), spec.window.start, spec.window.stop, spec.outlier_rule.key())
+        groups.setdefault(key, list()).append(spec)
+
+    for group in groups.values():
+        rule = group[0].outlier_rule
+        rejected, median, threshold = rule.detect(np.array([spec.pressure for spec in group]),
+                                                  np.array([spec.measured for spec in group]))
+        for i, spec in enumerate(group):
+            spec._cache['rejected'] = rejected[i]
+            spec._cache['outlier_stats'] = (median[i], threshold[i])
+
+
+def report(spec):
+    """
+    :param spec: <AptSpec> with an OutlierRule
+    :return: <list> of <dict> of REPORT_FIELDS, one per rejected sample of the window
+    """
+    if spec.outlier_rule is None:
+        return []
+    median, threshold = spec.outlier_stats
+    start = spec.window.indices(len(spec._datetime))[0]
+    rows = []
+    for i in np.flatnonzero(spec.rejected):
+        rows.append({
+            'spec': spec.name,
+            'sample': int(start + i),
+            'datetime': str(spec.datetime[i]),
+            'psi': float(spec.psi[i]),
+            'pressure': float(spec.pressure[i]),
+            'median': float(median[i]),
+            'deviation': float(spec.pressure[i] - median[i]),
+            'threshold': float(threshold[i])
+        })
+    return rows
+
+
+def log_report(specs, log, limit=10):
+    """
+    :param specs: <list> of <AptSpec>
+    :param log: <Logger>
+    :param limit: <int> rejected samples listed per spec
+    """
+    for spec in specs:
+        rows = report(spec)
+        if not rows:
+            continue
+        listed = ', '.join('{} ({:.3f} PSI)'.format(row['sample'], row['psi']) for row in rows[:limit])
+        more = ', ...' if len(rows) > limit else ''
+        log.info('AptSpec: "{}" rejected {} outlier(s) of {} samples: {}{}'.format(
+            spec.name, len(rows), len(spec.datetime), listed, more))
+
+
+def write_report(specs, file, log):
+    """
+    :param specs: <list> of <AptSpec>
+    :param file: <str> *.csv path, one row per rejected sample
+    :param log: <Logger>
+    """
+    rows = [row for spec in specs for row in report(spec)]
+    if os.path.dirname(file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    log.info('outliers: {} rejected sample(s) -> "{}"'.format(len(rows), file))
+
+
+def from_args(args):
+    """
+    :param args: <Namespace> parsed CLI arguments
+    :return: <OutlierRule> for [--clean] with [-clean_window] & [-clean_k], None if cleaning is off
+    """
+    if not args.clean:
+        return None
+    return OutlierRule(window=args.clean_window, k=args.clean_k)
@@ -0,0 +1,224 @@
+import csv
+import array
+import datetime
+import itertools
+
+import numpy as np
+
+from src import data_cache as dc
+from src import timing
+from src.read_xlsx import format_data_dict, read_spec_header, read_param_header
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+PRESSURE_UNITS = ('[psi]', '[v]')
+# int64 value of NaT, for rows without a readable date / time
+NAT = np.iinfo(np.int64).min
+
+
+def read_csv(file, start, log, end=None, cache_dir=None):
+    """
+    Streams a logger *.csv export into column arrays in a single pass. The header is either
+    two rows (name, unit) or three rows (name, sample #, unit), the body is
+    date, time, followed by one column per channel.
+
+    :param file: <str> path to the *.csv file
+    :param start: <int> first data row to analyze (0 = first row after the header)
+    :param log: <Logger> transporting python logger into this function for debugging.
+    :param end: <int> data row to stop at (exclusive), default=None reads to EOF
+    :param cache_dir: <str> directory of the parsed-column cache, default=None always parses the file
+    :return: data: <dict> of re-formatted test data, see format_data_dict()
+    :return: specs: <list> of spec keys, in column order
+    """
+    log.debug('-'*75)
+    log.debug('reading file: {}'.format(file))
+    log.debug('  test start: {}'.format(start))
+
+    # with a cache the whole file is parsed (or loaded) once and windowed afterwards, without one
+    # only the rows of the window are parsed (a negative start / end needs the row count first)
+    if not cache_dir and start >= 0 and (end is None or end >= 0):
+        with timing.stage('read/parse'):
+            data, specs, params = parse_csv(file, log, start, end)
+        first_row = start
+    else:
+        columns, specs, params = None, None, None
+        if cache_dir:
+            with timing.stage('read/cache_load'):
+                columns, specs, params = dc.load(file, 'csv', cache_dir, log)
+        if columns is None:
+            with timing.stage('read/parse'):
+                columns, specs, params = parse_csv(file, log)
+            if cache_dir:
+                with timing.stage('read/cache_store'):
+                    dc.store(file, 'csv', columns, specs, params, cache_dir, log)
+
+        window = slice(start, end or None)
+        data = {key: column[window] for key, column in columns.items()}
+        first_row = start if start >= 0 else window.indices(len(columns['datetime']))[0]
+
+    log.debug('  rows read: {}'.format(len(data['datetime'])))
+    log.debug('-'*75)
+    return format_data_dict(specs, params, data, log, first_row)
+
+
+def parse_csv(file, log, start=0, end=None):
+    """
+    :param file: <str> path to the *.csv file
+    :param log: <Logger>
+    :param start: <int> first data row to parse, default=0
+    :param end: <int> data row to stop at (exclusive), default=None parses to EOF
+    :return: columns: <dict> of key: float64 <ndarray> of the rows [start:end] per named column, plus 'datetime'
+    :return: specs: <list> of spec keys
+    :return: params: <list> of param keys
+    """
+    with open(file, newline='', encoding='latin-1') as f:
+        reader = csv.reader(f)
+        header, first = read_header(reader)
+        keys, specs, params = read_header_keys(header)
+        log.debug('  spec columns: {}'.format(specs))
+        log.debug('  param columns: {}'.format(params))
+
+        # the window counts data rows, empty lines inside the body are skipped first
+        rows = (row for row in itertools.chain([first], reader) if not is_empty(row))
+        columns = read_body(itertools.islice(rows, start, end or None), keys)
+
+    return columns, specs, params
+
+
+def read_header(reader):
+    """
+    :param reader: <csv.reader> positioned at the top of the file
+    :return: header: <list> of header rows (each a <list> of <str>)
+    :return: first: <list> the first body row, already consumed from the reader
+    """
+    header = []
+    for row in reader:
+        if row and row[0].strip():
+            return header, row
+        header.append(row)
+    return header, []
+
+
+def read_header_keys(header):
+    """
+    Builds the data-dict keys from the header rows, following the same naming as read_xlsx:
+    spec columns are "<name>_s<sample #>", the rest are read_param_header() keys.
+
+    :param header: <list> of header rows, name row first and unit row last
+    :return: keys: <list> of <str> key per body column (None for date/time and blank columns)
+    :return: specs: <list> of spec keys
+    :return: params: <list> of param keys
+    """
+    names = header[0]
+    units = header[-1] if len(header) > 1 else []
+    samples = header[1] if len(header) > 2 else []
+
+    keys = [None, None]
+    specs = []
+    params = []
+    for j in range(2, len(names)):
+        name = names[j].strip()
+        sample = samples[j].strip() if j < len(samples) else ''
+        unit = units[j].strip().lower() if j < len(units) else ''
+        if not name:
+            keys.append(None)
+            continue
+
+        if is_number(sample):
+            key = read_spec_header(name, float(sample))
+            specs.append(key)
+        elif not samples and unit in PRESSURE_UNITS:
+            key = name.lower()
+            specs.append(key)
+        else:
+            key = read_param_header(name, sample)
+            params.append(key)
+        keys.append(key)
+
+    return keys, specs, params
+
+
+def read_body(rows, keys):
+    """
+    :param rows: <iterable> of body rows
+    :param keys: <list> of column keys, see read_header_keys()
+    :return: data: <dict> flat dictionary of column arrays, blank & text cells as NaN, plus 'datetime'
+             as <datetime64[s]>, NaT where the date or time cell is blank or unreadable (as in read_xlsx)
+    """
+    columns = [(j, key, array.array('d')) for j, key in enumerate(keys) if key]
+    seconds = array.array('q')
+    dates = {}
+    nan = float('nan')
+
+    for row in rows:
+        if is_empty(row):
+            continue
+        try:
+            date = dates.get(row[0])
+            if date is None:
+                date = dates[row[0]] = read_date(row[0])
+            seconds.append(date + read_time(row[1] if len(row) > 1 else ''))
+        except ValueError:
+            # the row is kept so the rows after it stay aligned, AptSpec.measured masks it
+            seconds.append(NAT)
+
+        n = len(row)
+        for j, key, values in columns:
+            value = row[j].strip() if j < n else ''
+            try:
+                values.append(float(value) if value else nan)
+            except ValueError:
+                # text cells like "OVER" or "---" are NaN, as in read_xlsx
+                values.append(nan)
+
+    data = {key: np.frombuffer(values, dtype=np.float64) for j, key, values in columns}
+    data['datetime'] = np.frombuffer(seconds, dtype=np.int64).astype('datetime64[s]')
+    return data
+
+
+def is_empty(row):
+    """
+    :param row: <list> of <str> cells
+    :return: <bool> True for a line without any value, e.g. a trailing blank line
+    """
+    return not any(cell.strip() for cell in row)
+
+
+def read_date(value):
+    """
+    :param value: <str> date as "m/d/yyyy"
+    :return: <int> seconds since the epoch at midnight of that date
+    """
+    month, day, year = value.strip().split('/')
+    return (datetime.date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL) * 86400
+
+
+def read_time(value):
+    """
+    :param value: <str> time as "h:mm:ss AM/PM" or "hh:mm:ss"
+    :return: <int> seconds since midnight
+    """
+    value = value.strip()
+    meridiem = value[-2:].upper()
+    if meridiem in ('AM', 'PM'):
+        value = value[:-2]
+
+    parts = [int(float(part)) for part in value.split(':')]
+    hours, minutes, seconds = (parts + [0, 0])[:3]
+    if meridiem == 'AM' and hours == 12:
+        hours = 0
+    elif meridiem == 'PM' and hours != 12:
+        hours += 12
+
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def is_number(value):
+    """
+    :param value: <str>
+    :return: <bool> True if value is float() convertible
+    """
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
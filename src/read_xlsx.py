@@ -1,73 +1,153 @@
-import datetime
-import xlrd
+import numpy as np
 
+from src import data_cache as dc
+from src import timing
 
-def read_xlsx(file, start, log, end=None):
+HEADER_ROWS = 3
+SECONDS_PER_DAY = 86400
+
+# excel serial day of 1970-01-01, per workbook datemode (0: 1900-based, 1: 1904-based)
+EXCEL_EPOCH = {0: 25569, 1: 24107}
+# xlrd cell types of numeric cells; xlrd itself is only imported by parse_xlsx(), read_csv() uses
+# this module for format_data_dict() alone
+XL_CELL_NUMBER = 2
+XL_CELL_DATE = 3
+
+
+def read_xlsx(file, start, log, end=None, cache_dir=None):
+    """
+    :param file: <str> path to the *.xlsx file
+    :param start: <int> first data row to analyze (0 = first row after the header)
+    :param log: <Logger> transporting python logger into this function for debugging.
+    :param end: <int> data row to stop at (exclusive), default=None reads to the last row
+    :param cache_dir: <str> directory of the parsed-column cache, default=None always parses the file
+    :return: data: <dict> of re-formatted test data, see format_data_dict()
+    :return: specs: <list> of spec keys, in column order
+    """
     # starting read_xlsx() function debug.log
     log.debug('-'*75)
     log.debug('reading file: {}'.format(file))
     log.debug('  test start: {}'.format(start))
 
-    # fix data offset & vars
-    start = start + 3
-    if end:
-        end = end + 3
-    data = {}
-    dates = []
-    times = []
-    specs = []
-    params = []
+    # with a cache the whole sheet is parsed (or loaded) once and windowed afterwards, without one
+    # only the rows of the window are converted (a negative start / end needs the row count first)
+    if not cache_dir and start >= 0 and (end is None or end >= 0):
+        with timing.stage('read/parse'):
+            data, specs, params = parse_xlsx(file, log, start, end)
+        first_row = start
+    else:
+        columns, specs, params = None, None, None
+        if cache_dir:
+            with timing.stage('read/cache_load'):
+                columns, specs, params = dc.load(file, 'xlsx', cache_dir, log)
+        if columns is None:
+            with timing.stage('read/parse'):
+                columns, specs, params = parse_xlsx(file, log)
+            if cache_dir:
+                with timing.stage('read/cache_store'):
+                    dc.store(file, 'xlsx', columns, specs, params, cache_dir, log)
+
+        window = slice(start, end or None)
+        data = {key: column[window] for key, column in columns.items()}
+        first_row = start if start >= 0 else window.indices(len(columns['datetime']))[0]
 
-    # open specified workbook
-    wb = xlrd.open_workbook(file)
+    # format data-object for easy class creation
+    log.debug('-'*75)
+    return format_data_dict(specs, params, data, log, first_row)
 
-    # loop through the worksheets... this should probably be discarded, as there should only ever be 1
-    for i in range(wb.nsheets):
-        ws = wb.sheet_by_index(i)
-        log.debug(" worksheet {}: {}".format(i + 1, ws.name))
 
-        for j in range(ws.ncols):
-            if j == 0:  # function read_date
-                dates = read_date(wb, ws, j, start, end)
+def parse_xlsx(file, log, start=0, end=None):
+    """
+    :param file: <str> path to the *.xlsx file
+    :param log: <Logger>
+    :param start: <int> first data row to convert, default=0
+    :param end: <int> data row to stop at (exclusive), default=None converts to the last row
+    :return: columns: <dict> of key: float64 <ndarray> of the rows [start:end] per named column, plus 'datetime'
+    :return: specs: <list> of spec keys
+    :return: params: <list> of param keys
+    """
+    import xlrd
 
-            elif j == 1:  # function read_time
-                times = read_time(ws, j, start, end)
+    # open specified workbook, there should only ever be 1 worksheet
+    wb = xlrd.open_workbook(file)
+    ws = wb.sheet_by_index(0)
+    log.debug(" worksheet {}: {}".format(1, ws.name))
+    if wb.nsheets > 1:
+        log.debug(' ignoring worksheets: {}'.format(wb.sheet_names()[1:]))
 
-            else:
-                if isinstance(ws.cell_value(1, j), (int, float)):  # read_spec_header
-                    key = read_spec_header(ws, j)
-                    specs.append(key)
-                else:  # read_param_header
-                    key = read_param_header(ws, j)
-                    params.append(key)
+    # load the used range once, then classify the columns from the header rows in bulk
+    header = [ws.row_values(row) for row in range(HEADER_ROWS)]
+    body = read_body(ws, HEADER_ROWS + start, HEADER_ROWS + end if end else None)
+    keys, specs, params = read_header_keys(header[0], header[1])
 
-                if key:  # read_data
-                    data = read_data(ws, j, key, data, start, end)
+    columns = {}
+    for j, key in enumerate(keys):
+        if key:
+            columns[key.lower()] = body[:, j]
 
-        if dates and times:
-            data['datetime'] = [datetime.datetime.combine(date, times[i]) for i, date in enumerate(dates)]
+    if body.shape[1] >= 2:
+        columns['datetime'] = read_datetime(body[:, 0], body[:, 1], wb.datemode)
 
-    # format data-object for easy class creation
-    log.debug('-'*75)
-    return format_data_dict(specs, params, data, log)
+    return columns, specs, params
 
 
-def read_spec_header(w, i):
+def read_body(w, start, end=None):
     """
     :param w: <xlrd> worksheet
-    :param i: <int> column #
+    :param start: <int> denoting starting row #
+    :param end: <int> denoting ending row #, default=None
+    :return: <ndarray> 2-D float64 array of the used range, blank & text cells as NaN
+    """
+    rows = range(start, min(end, w.nrows) if end else w.nrows)
+    body = np.array([w.row_values(row) for row in rows], dtype=object).reshape(len(rows), w.ncols)
+    types = np.array([w.row_types(row) for row in rows], dtype=np.int8).reshape(len(rows), w.ncols)
+    body[(types != XL_CELL_NUMBER) & (types != XL_CELL_DATE)] = np.nan
+    return body.astype(np.float64)
+
+
+def read_header_keys(names, samples):
+    """
+    Classifies every column from the header rows: spec columns have a numeric sample # under the
+    name, all other named columns are params (baro, thermocouples). Columns 0 & 1 are date & time.
+
+    :param names: <list> header row 0 (channel names)
+    :param samples: <list> header row 1 (sample #'s)
+    :return: keys: <list> of <str> key per column (None for date/time and blank columns)
+    :return: specs: <list> of spec keys
+    :return: params: <list> of param keys
+    """
+    keys = [None, None]
+    specs = []
+    params = []
+    for name, sample in list(zip(names, samples))[2:]:
+        if isinstance(sample, (int, float)):  # read_spec_header
+            key = read_spec_header(name, sample)
+            specs.append(key)
+        else:  # read_param_header
+            key = read_param_header(name, sample)
+            if key:
+                params.append(key)
+        keys.append(key or None)
+
+    return keys, specs, params
+
+
+def read_spec_header(name, sample):
+    """
+    :param name: header row 0 cell value
+    :param sample: header row 1 cell value, <int>/<float> sample #
     :return: <str> spec_header as str()
     """
-    return (str(w.cell_value(0, i)) + '_s' + str(int(w.cell_value(1, i)))).lower()
+    return (str(name) + '_s' + str(int(sample))).lower()
 
 
-def read_param_header(w, i):
+def read_param_header(name, sample):
     """
-    :param w: <xlrd> worksheet (xlrd obj)
-    :param i: <int> column #
+    :param name: header row 0 cell value
+    :param sample: header row 1 cell value
     :return: <str> param_header as str()
     """
-    return (str(w.cell_value(0, i)) + '_' + str(w.cell_value(1, i)))\
+    return (str(name) + '_' + str(sample))\
         .replace('[', '')\
         .replace(']', '')\
         .replace('°', 'deg_')\
@@ -76,73 +156,34 @@ def read_param_header(w, i):
         .lower()
 
 
-def read_time(w, i, start, end=None):
+def read_datetime(dates, times, datemode):
     """
-    :param w: <xlrd> worksheet
-    :param i: <int> denoting column #
-    :param start: <int> denoting starting row #
-    :param end: <int> denoting ending row #
-    :return: <list> of datetime objects
-    """
-    if end:
-        return [datetime.time((int(val * 24 * 3600) // 3600),       # hours
-                              (int(val * 24 * 3600) % 3600) // 60,  # minutes
-                              (int(val * 24 * 3600) % 60))          # seconds
-                for val in w.col_values(i, start, end)]
-    else:
-        return [datetime.time((int(val * 24 * 3600) // 3600),  # hours
-                              (int(val * 24 * 3600) % 3600) // 60,  # minutes
-                              (int(val * 24 * 3600) % 60))  # seconds
-                for val in w.col_values(i, start)]
-
-
-def read_date(b, w, i, start, end=None):
+    :param dates: <ndarray> excel serial dates (whole days)
+    :param times: <ndarray> excel serial times (fraction of a day)
+    :param datemode: <int> workbook datemode
+    :return: <ndarray> of <datetime64[s]>, NaT where the date or time cell isn't a number
     """
-    :param b: <xlrd> workbook
-    :param w: <xlrd> worksheet
-    :param i: <int> denoting column #
-    :param start: <int> denoting starting row #
-    :param end: <int> denoted ending row #, default=None
-    :return:
-    """
-    if end:
-        return [datetime.datetime(*xlrd.xldate_as_tuple(val, b.datemode)) for val in w.col_values(i, start, end)]
-    else:
-        return [datetime.datetime(*xlrd.xldate_as_tuple(val, b.datemode)) for val in w.col_values(i, start)]
+    days = np.floor(dates) - EXCEL_EPOCH[datemode]
+    seconds = days * SECONDS_PER_DAY + np.round(times * SECONDS_PER_DAY)
+    # NaN has no integer value, only the finite seconds are cast
+    finite = np.isfinite(seconds)
+    datetime = np.full(len(seconds), np.datetime64('NaT'), dtype='datetime64[s]')
+    datetime[finite] = seconds[finite].astype(np.int64).astype('datetime64[s]')
+    return datetime
 
 
-def read_data(w, i, key, data, start, end=None):
+def format_data_dict(specs, params, data, log, first_row=0):
     """
-    :param w: <xlrd> worksheet
-    :param i: <int> denotes column # in worksheet
-    :param key: <str> denotes str-object to use as dict key
-    :param data: <dict> object to populate with data
-    :param start: <int> denotes starting row #
-    :param end: <int> denotes ending row #
-    :return: data: <dict>
-    """
-    if end:
-        data[key.lower()] = []
-        temp = w.col_values(i, start, end)
-        for item in temp:
-            if item:
-                data[key.lower()].append(item)
-    else:
-        data[key.lower()] = []
-        temp = w.col_values(i, start)
-        for item in temp:
-            if item:
-                data[key.lower()].append(item)
-
-    return data
+    Every column keeps one value per row, blank & text cells are NaN, so a missing (or a legitimate
+    0.0) reading never shifts the readings after it against the datetime column. Which rows have a
+    reading is left to AptSpec.measured, per data window: a mask over the whole column would read
+    every page of a memory-mapped cache.
 
-
-def format_data_dict(specs, params, data, log):
-    """
     :param log: <Logger> transporting python logger into this function for debugging.
     :param specs: <list> of spec keys in data dict.
     :param params: <list> of temp and baro keys in data dict
     :param data: <dict> flat dictionary of the populated test data
+    :param first_row: <int> data row of the file the columns begin at, e.g. a resolved [-start]
     :return: d: <dict> dictionary of re-formatted test data
     :return: specs: unchanged from input.. returned to keep track of order
     """
@@ -150,7 +191,8 @@ def format_data_dict(specs, params, data, log):
     for spec in specs:
         d[spec] = {
             'psi': data[spec],
-            'datetime': data['datetime']
+            'datetime': data['datetime'],
+            'first_row': first_row
         }
         for param in params:
             d[spec][param] = data[param]
@@ -0,0 +1,196 @@
+import numpy as np
+
+from src import outliers as ol
+
+
+class Segments:
+    def __init__(self, start=None, end=None, rises=None, deflations=None, segments=None):
+        """
+        The change points of one spec & the data window they select, used like a <Trim>.
+
+        :param start: <int> first sample of the test (after the last re-inflation), default=None
+        :param end: <int> end sample (exclusive) of the useful data, the deflation; None runs to the
+                    end of the data, e.g. while a live test is still logging
+        :param rises: <list> of <int> first samples after an inflation / re-pressurization
+        :param deflations: <list> of <int> first samples after a deflation
+        :param segments: <list> of (start, end) inflated segments between the change points
+        """
+        self.start = start
+        self.end = end
+        self.rises = rises or list()
+        self.deflations = deflations or list()
+        self.segments = segments or list()
+
+    def __repr__(self):
+        return 'Segments(start={}, end={}, rises={}, deflations={})'.format(
+            self.start, self.end, self.rises, self.deflations)
+
+
+class SegmentRule:
+    def __init__(self, step=2.0, ambient=2.0, min_samples=10):
+        """
+        Finds where the test starts & ends in a raw export that also logged the setup: a rise of more
+        than step PSI between two samples is an inflation (a decaying spec can't gain pressure), a
+        drop of more than step PSI onto ambient pressure is a deflation. Fast leaks decay gradually,
+        so they aren't mistaken for one. The data window is the last segment that starts inflated, i.e.
+        the test after the latest re-pressurization, up to the deflation.
+
+        :param step: <float> smallest change (PSI) between two samples counted as inflation / deflation
+        :param ambient: <float> gauge pressure (PSI) below which a spec counts as deflated
+        :param min_samples: <int> shortest segment counted as a test, skips spikes & inflation ramps
+        """
+        if step <= 0:
+            raise ValueError('segment step must be > 0 PSI, given: {}'.format(step))
+        if min_samples < 4:
+            raise ValueError('segments need at least 4 samples to fit, given: {}'.format(min_samples))
+        self.step = float(step)
+        self.ambient = float(ambient)
+        self.min_samples = int(min_samples)
+
+    def __repr__(self):
+        return 'SegmentRule(step={}, ambient={}, min_samples={})'.format(self.step, self.ambient, self.min_samples)
+
+    def detect(self, psi, valid=None):
+        """
+        :param psi: <ndarray> (n_specs, n_samples) measured pressures of specs sharing a time axis
+        :param valid: <ndarray> of <bool> like psi, samples with a reading, default=None uses the finite ones
+        :return: <list> of <Segments> per spec, None for a spec that was never inflated
+        """
+        psi = np.atleast_2d(np.asarray(psi, dtype=np.float64))
+        valid = np.isfinite(psi) if valid is None else np.atleast_2d(valid) & np.isfinite(psi)
+        filled = ol.fill_invalid(psi, valid)
+        rows, n = filled.shape
+
+        # a single-sample glitch jumps away & straight back, it isn't a deflation + re-inflation
+        if n > 2:
+            glitch = ((np.abs(filled[:, 1:-1] - filled[:, :-2]) > self.step) &
+                      (np.abs(filled[:, 2:] - filled[:, :-2]) <= self.step))
+            if glitch.any():
+                filled = filled.copy()
+                filled[:, 1:-1][glitch] = filled[:, :-2][glitch]
+
+        # change points of every spec at once; an event at i means sample i is the first one after it
+        diff = np.diff(filled, axis=1)
+        rises = diff > self.step
+        deflations = (diff < -self.step) & (filled[:, 1:] < self.ambient)
+        inflated = np.zeros((rows, n + 1), dtype=np.int64)
+        np.cumsum(filled > self.ambient, axis=1, out=inflated[:, 1:])
+
+        results = []
+        for i in range(rows):
+            up = np.flatnonzero(rises[i]) + 1
+            down = np.flatnonzero(deflations[i]) + 1
+            bounds = np.unique(np.concatenate([[0], up, down, [n]]))
+
+            segments = []
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                # a test starts inflated, though a fast leak may spend most of it at ambient
+                first = start + self.min_samples
+                if end >= first and 2 * (inflated[i, first] - inflated[i, start]) > self.min_samples:
+                    segments.append((int(start), int(end)))
+            if not segments:
+                results.append(None)
+                continue
+
+            start, end = segments[-1]
+            results.append(Segments(start, end if end < n else None, up.tolist(), down.tolist(), segments))
+        return results
+
+    def resolve(self, data):
+        """
+        :param data: <dict> of spec key: AptSpec kwargs, as returned by read_xlsx() / read_csv()
+        :return: <dict> of spec key: <Segments>, for the specs with a test segment only
+        """
+        groups = dict()
+        for key, kwargs in data.items():
+            groups.setdefault(id(kwargs['datetime']), list()).append(key)
+
+        segments = dict()
+        for keys in groups.values():
+            psi = np.array([data[key]['psi'] for key in keys])
+            valid = stack_masks([data[key].get('valid') for key in keys], psi.shape[1])
+            for key, result in zip(keys, self.detect(psi, valid)):
+                if result is not None:
+                    segments[key] = result
+        return segments
+
+    def resolve_specs(self, specs):
+        """
+        Like resolve(), on the full-length columns of specs, e.g. after new rows were appended to a
+        live test
+
+        :param specs: <list> of <AptSpec>
+        :return: <dict> of spec name: <Segments>, for the specs with a test segment only
+        """
+        groups = dict()
+        for spec in specs:
+            groups.setdefault(id(spec._datetime), list()).append(spec)
+
+        segments = dict()
+        for group in groups.values():
+            psi = np.array([spec._psi for spec in group])
+            results = self.detect(psi, stack_masks([spec._valid for spec in group], psi.shape[1]))
+            for spec, result in zip(group, results):
+                if result is not None:
+                    segments[spec.name] = result
+        return segments
+
+
+def stack_masks(masks, n):
+    """
+    :param masks: <list> of the valid mask (<ndarray> of <bool>) given per spec, None where there is none
+    :param n: <int> samples per spec
+    :return: <ndarray> (n_specs, n) of <bool>, all True for a spec without a mask; None if no spec has one
+    """
+    if all(mask is None for mask in masks):
+        return None
+    return np.array([np.ones(n, dtype=bool) if mask is None else mask for mask in masks])
+
+
+def log_report(data, segments, log):
+    """
+    :param data: <dict> of spec key: AptSpec kwargs, or <list> of spec keys
+    :param segments: <dict> of spec key: <Segments>, see SegmentRule.resolve()
+    :param log: <Logger>
+    """
+    for key in data:
+        result = segments.get(key)
+        if result is None:
+            log.warning('segment: "{}" has no inflated test segment, its window is left as is'.format(key))
+            continue
+        events = ''
+        if result.rises:
+            events += ', inflated at {}'.format(result.rises)
+        if result.deflations:
+            events += ', deflated at {}'.format(result.deflations)
+        log.info('segment: "{}" test samples [{}:{}]{}'.format(
+            key, result.start, '' if result.end is None else result.end, events))
+
+
+def windows(data, log, segment_rule=None, trim_rule=None):
+    """
+    :param data: <dict> of spec key: AptSpec kwargs, as returned by read_xlsx() / read_csv()
+    :param log: <Logger>
+    :param segment_rule: <SegmentRule> finding the test segment of every spec, default=None
+    :param trim_rule: <TrimRule> windowing the selected specs, overrides their segment, default=None
+    :return: <dict> of spec key: <Trim> / <Segments>, the data window of every windowed spec; None if neither rule is on
+    """
+    if not segment_rule and not trim_rule:
+        return None
+    result = dict()
+    if segment_rule:
+        result = segment_rule.resolve(data)
+        log_report(data, result, log)
+    if trim_rule:
+        result.update(trim_rule.resolve(data))
+    return result
+
+
+def from_args(args):
+    """
+    :param args: <Namespace> parsed CLI arguments
+    :return: <SegmentRule> for [--segment] with [-segment_step] & [-segment_ambient], None if segmentation is off
+    """
+    if not args.segment:
+        return None
+    return SegmentRule(step=args.segment_step, ambient=args.segment_ambient)
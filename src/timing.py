@@ -0,0 +1,86 @@
+import json
+import time
+import tracemalloc
+import contextlib
+
+MB = 1 << 20
+
+
+class Timer:
+    def __init__(self):
+        """
+        Collects the wall time of named pipeline stages, e.g. "read/parse" or "write/sheet/p40_s1".
+        While tracemalloc is tracing, each stage also records its peak traced memory; a nested stage's
+        peak counts towards its parent.
+        """
+        self.records = list()
+        self.start = time.perf_counter()
+        self._peaks = list()
+
+    def reset(self):
+        self.records = list()
+        self.start = time.perf_counter()
+        self._peaks = list()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        :param name: <str> stage name, "/" separated from general to specific
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {'stage': name, 'seconds': time.perf_counter() - t0}
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                record['peak_mb'] = peak / MB
+            self.records.append(record)
+
+    def add(self, name, seconds):
+        """
+        Records a stage timed elsewhere, e.g. the solver time of a FitResult
+        """
+        self.records.append({'stage': name, 'seconds': seconds})
+
+    def summary(self):
+        """
+        :return: <dict> total seconds since the timer started & every stage in order of completion
+        """
+        return {'total_seconds': time.perf_counter() - self.start, 'stages': list(self.records)}
+
+    def log(self, log):
+        """
+        :param log: <Logger>
+        """
+        log.info('-'*75)
+        for record in self.records:
+            peak = ', peak {:.1f} MB'.format(record['peak_mb']) if 'peak_mb' in record else ''
+            log.info('timing: {:<40} {:9.4f}s{}'.format(record['stage'], record['seconds'], peak))
+        log.info('timing: {:<40} {:9.4f}s'.format('total', time.perf_counter() - self.start))
+        log.info('-'*75)
+
+    def write(self, file, **info):
+        """
+        :param file: <str> *.json path of the machine readable summary
+        :param info: extra top-level keys, e.g. the input file & arguments
+        """
+        with open(file, 'w') as f:
+            json.dump(dict(info, **self.summary()), f, indent=1)
+
+
+# the process-wide timer the pipeline stages report to, like logging.getLogger('status')
+timer = Timer()
+
+
+def stage(name):
+    return timer.stage(name)
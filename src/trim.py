@@ -0,0 +1,128 @@
+import re
+import numpy as np
+
+SAMPLE_SUFFIX = re.compile(r'_s(\d+)$')
+SECONDS_PER_HOUR = 3600
+
+
+class Trim:
+    def __init__(self, start=None, end=None):
+        """
+        :param start: <int> first sample index of the window, default=None
+        :param end: <int> end sample index of the window (exclusive), default=None
+        """
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'Trim(start={}, end={})'.format(self.start, self.end)
+
+
+class TrimRule:
+    def __init__(self, hours=None, samples=None, labels=None, sample_numbers=None):
+        """
+        WHERE to trim is given in hours since the first sample, or in sample counts, each as
+        [start] or [start, end]. WHAT to trim is selected by spec labels and/or sample #'s;
+        with neither, every spec is trimmed.
+
+        :param hours: <list> of <float> start [, end] hour, default=None
+        :param samples: <list> of <int> start [, end] sample, default=None
+        :param labels: <list> of <str> spec labels, e.g. "p40" or "p40_s1", default=None
+        :param sample_numbers: <list> of <int> sample #'s, e.g. 1 for "p40_s1", default=None
+        """
+        if hours and samples:
+            raise ValueError('trim by either hours [-t] or samples [-n], not both')
+        for bounds in (hours, samples):
+            if bounds and len(bounds) > 2:
+                raise ValueError('trim takes a start and an optional end, given: {}'.format(bounds))
+
+        self.hours = [float(hour) for hour in hours] if hours else None
+        self.samples = [int(sample) for sample in samples] if samples else None
+        self.labels = [label.lower() for label in labels] if labels else None
+        self.sample_numbers = [int(number) for number in sample_numbers] if sample_numbers else None
+
+    def __repr__(self):
+        return 'TrimRule(hours={}, samples={}, labels={}, sample_numbers={})'.format(
+            self.hours, self.samples, self.labels, self.sample_numbers)
+
+    def selects(self, key):
+        """
+        :param key: <str> spec key, e.g. "p40_s1"
+        :return: <bool> True if the spec is picked by the labels / sample #'s
+        """
+        if self.labels and not any(key == label or key.startswith(label + '_') for label in self.labels):
+            return False
+        if self.sample_numbers:
+            sample = SAMPLE_SUFFIX.search(key)
+            return bool(sample) and int(sample.group(1)) in self.sample_numbers
+        return True
+
+    def check(self, keys):
+        """
+        :param keys: <list> of the spec keys of a test file
+        :raises ValueError: if a label or sample # matches none of the specs, e.g. a typo in [-l]
+        """
+        for label in self.labels or ():
+            if not any(key == label or key.startswith(label + '_') for key in keys):
+                raise ValueError('label "{}" matches none of the specs: {}'.format(label, ', '.join(keys)))
+        numbers = [int(sample.group(1)) for sample in map(SAMPLE_SUFFIX.search, keys) if sample]
+        for number in self.sample_numbers or ():
+            if number not in numbers:
+                raise ValueError('sample # {} matches none of the specs: {}'.format(number, ', '.join(keys)))
+        if not any(self.selects(key) for key in keys):
+            raise ValueError('labels {} & sample #\'s {} select none of the specs: {}'.format(
+                self.labels, self.sample_numbers, ', '.join(keys)))
+
+    def window(self, datetime):
+        """
+        Resolves the rule to sample indices; hours are found by binary search on the sorted time axis.
+
+        :param datetime: <ndarray> of <datetime64[s]>, sorted
+        :return: <Trim>
+        """
+        n = len(datetime)
+        start, end = 0, n
+        if n and self.hours:
+            start = int(np.searchsorted(datetime, datetime[0] + to_timedelta(self.hours[0]), side='left'))
+            if len(self.hours) > 1:
+                end = int(np.searchsorted(datetime, datetime[0] + to_timedelta(self.hours[1]), side='right'))
+        elif self.samples:
+            start, end, _ = slice(self.samples[0], self.samples[1] if len(self.samples) > 1 else None).indices(n)
+
+        if end - start < 1:
+            raise ValueError('trim window {} is empty for {} samples'.format(self, n))
+        return Trim(start, end)
+
+    def resolve(self, data):
+        """
+        :param data: <dict> of spec key: AptSpec kwargs, as returned by read_xlsx() / read_csv()
+        :return: <dict> of spec key: <Trim>, for the selected specs only
+        """
+        self.check(list(data))
+        trims = dict()
+        windows = dict()
+        for key, kwargs in data.items():
+            if self.selects(key):
+                datetime = kwargs['datetime']
+                if id(datetime) not in windows:
+                    windows[id(datetime)] = self.window(datetime)
+                trims[key] = windows[id(datetime)]
+        return trims
+
+
+def to_timedelta(hours):
+    """
+    :param hours: <float> hours
+    :return: <timedelta64[s]>
+    """
+    return np.timedelta64(int(round(hours * SECONDS_PER_HOUR)), 's')
+
+
+def from_args(args):
+    """
+    :param args: <Namespace> parsed CLI arguments
+    :return: <TrimRule> for [--trim] with [-t]/[-n] and [-l]/[-s], None if trimming is off
+    """
+    if not args.trim:
+        return None
+    return TrimRule(hours=args.t, samples=args.n, labels=args.l, sample_numbers=args.s)
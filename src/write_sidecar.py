@@ -0,0 +1,117 @@
+import os
+import csv
+import json
+import math
+
+from src import exp_fit
+
+FIELDS = (
+    'spec', 'n_samples', 'n_valid', 'n_rejected', 'start', 'end', 'hours',
+    'status', 'stage', 'loss', 'reason', 'nfev',
+    'a', 'b', 'c', 'a_err', 'b_err', 'c_err',
+    'measured_start', 'measured_end', 'measured_difference', 'measured_reduction', 'measured_loss_hr',
+    'fit_start', 'fit_end', 'fit_difference', 'fit_reduction', 'fit_loss_hr',
+    'loss_rate',
+    'a_lower', 'a_upper', 'b_lower', 'b_upper', 'c_lower', 'c_upper', 'bootstrap_n'
+)
+
+
+def spec_metrics(spec, bootstrap=None):
+    """
+    The fit and the summary-sheet metrics of one spec: pressure difference, % reduction & loss/hr
+    over the test, both measured (normalized pressure) and from the curve fit. Samples without a
+    reading are left out, see AptSpec.valid.
+
+    :param spec: <AptSpec> fitted spec
+    :param bootstrap: <BootstrapResult> intervals of a, b & c, default=None
+    :return: <dict> of FIELDS
+    """
+    fit = spec.fit
+    time = spec.valid_time
+    pressure = spec.valid_pressure
+    n = len(time)
+    hours = float(time[-1]) if n else 0.0
+    datetime = spec.datetime if spec.complete else spec.datetime[spec.valid]
+
+    metrics = dict.fromkeys(FIELDS)
+    metrics.update({
+        'spec': spec.name,
+        'n_samples': len(spec.datetime),
+        'n_valid': n,
+        'n_rejected': int(spec.rejected.sum()),
+        'start': str(datetime[0]) if n else None,
+        'end': str(datetime[-1]) if n else None,
+        'hours': hours,
+        'status': fit.status,
+        'stage': fit.stage,
+        'loss': fit.loss,
+        'reason': fit.reason,
+        'nfev': fit.nfev
+    })
+    if n:
+        metrics.update(pressure_loss('measured', pressure[0], pressure[-1], hours))
+
+    if fit.success:
+        a, b, c = fit.popt
+        metrics.update(dict(zip(('a', 'b', 'c', 'a_err', 'b_err', 'c_err'), list(fit.popt) + list(fit.perr))))
+        metrics.update(pressure_loss('fit', a + c, exp_fit.exp_model(hours, a, b, c), hours))
+        metrics['loss_rate'] = exp_fit.loss_rate(fit.popt, hours)
+
+    if bootstrap is not None and bootstrap.n:
+        for name, (lower, upper) in bootstrap.intervals.items():
+            metrics[name + '_lower'], metrics[name + '_upper'] = lower, upper
+        metrics['bootstrap_n'] = bootstrap.n
+
+    return {key: clean(value) for key, value in metrics.items()}
+
+
+def pressure_loss(prefix, start, end, hours):
+    """
+    :return: <dict> of <prefix>_start, _end, _difference, _reduction (%) & _loss_hr (PSI/hr)
+    """
+    difference = start - end
+    return {
+        prefix + '_start': start,
+        prefix + '_end': end,
+        prefix + '_difference': difference,
+        prefix + '_reduction': 100 * difference / start if start else None,
+        prefix + '_loss_hr': difference / hours if hours else None
+    }
+
+
+def clean(value):
+    """
+    :return: value as a plain python type, NaN/INF as None
+    """
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def write_sidecar(specs, file, log, bootstraps=None):
+    """
+    Writes the fits & derived metrics of every spec to a small *.json or *.csv file, which is cheap
+    enough to regenerate on every update while the full *.xlsx report is only written on demand.
+    The file is replaced atomically, so readers never see a partial update.
+
+    :param specs: <list> of fitted <AptSpec>
+    :param file: <str> output path, *.json or *.csv
+    :param log: <Logger>
+    :param bootstraps: <list> of <BootstrapResult>, in the order of specs, default=None
+    """
+    rows = [spec_metrics(spec, bootstrap) for spec, bootstrap in zip(specs, bootstraps or [None] * len(specs))]
+
+    if os.path.dirname(file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = file + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        if file.split('.')[-1].lower() == 'csv':
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump({'specs': rows}, f, indent=1)
+    os.replace(tmp, file)
+    log.debug('sidecar: {} spec(s) -> "{}"'.format(len(rows), file))
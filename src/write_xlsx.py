@@ -1,33 +1,137 @@
+import os
 import xlsxwriter
 import string
+import numpy as np
+
+from xlsxwriter.utility import xl_cell_to_rowcol
+
+from src import timing
 
 ALPHA = {char: int(val) for val, char in enumerate(list(string.ascii_uppercase))}
 
+# first (zero-indexed) row of the data columns on a spec page, below the 2-row data headers
+DATA_ROW = 2
+
 # for i, spec in enumerate(apt_specs):
 #     tmp_ws = wb.add_worksheet(name=str(order[i]))
 #
 # wb.add_worksheet(name='raw_data')
 
 
-def write_xlsx(apt_specs, order, raw_data, log):
-    wb = xlsxwriter.Workbook('temp.xlsx')
+class RowWriter:
+    def __init__(self, sheet, constant_memory=False):
+        """
+        Buffers the cell writes of a worksheet and emits them strictly row-in-order, which is what
+        xlsxwriter's constant_memory mode requires: once a later row is written, earlier rows are
+        flushed to disk and any further writes to them are silently dropped.
+
+        write(), merge_range() and write_rich_string() take the same A1-style arguments as the
+        worksheet methods, everything else (set_row, set_column, insert_chart, ..) passes through.
+
+        :param sheet: <xlsxwriter> worksheet
+        :param constant_memory: <bool> the workbook was opened in constant_memory mode
+        """
+        self.sheet = sheet
+        self.constant_memory = constant_memory
+        self.pending = dict()
+
+    def __getattr__(self, name):
+        return getattr(self.sheet, name)
+
+    def _add(self, row, col, method, *args):
+        self.pending.setdefault(row, list()).append((col, method, args))
+
+    def write(self, cell, *args):
+        row, col = xl_cell_to_rowcol(cell)
+        self._add(row, col, self.sheet.write, row, col, *args)
+
+    def write_rich_string(self, cell, *args):
+        row, col = xl_cell_to_rowcol(cell)
+        self._add(row, col, self.sheet.write_rich_string, row, col, *args)
+
+    def merge_range(self, cell_range, data, cell_format=None):
+        first, last = cell_range.split(':')
+        first_row, first_col = xl_cell_to_rowcol(first)
+        last_row, last_col = xl_cell_to_rowcol(last)
+
+        if not self.constant_memory:
+            self._add(first_row, first_col, self.sheet.merge_range,
+                      first_row, first_col, last_row, last_col, data, cell_format)
+            return
+
+        # worksheet.merge_range() writes every row of the range at once, so in constant_memory mode
+        # the range is registered up front and its cells are written with the rest of each row
+        self.sheet.merge.append([first_row, first_col, last_row, last_col])
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                if (row, col) == (first_row, first_col):
+                    self._add(row, col, self.sheet.write, row, col, data, cell_format)
+                else:
+                    self._add(row, col, self.sheet.write_blank, row, col, None, cell_format)
+
+    def write_row(self, row, col, data, cell_format=None):
+        """
+        Writes a row of values starting at (row, col) together with any buffered cells of that row.
+        """
+        for j, value in enumerate(data):
+            self._add(row, col + j, self.sheet.write, row, col + j, value, cell_format)
+        self.flush(row)
+
+    def flush(self, through=None):
+        """
+        Emits the buffered rows in order, up to and including row "through" (default: all rows).
+        """
+        for row in sorted(self.pending):
+            if through is not None and row > through:
+                break
+            for col, method, args in sorted(self.pending.pop(row), key=lambda op: op[0]):
+                method(*args)
+
+
+def write_xlsx(apt_specs, order, raw_data, log, file='temp.xlsx', constant_memory=False):
+    """
+    :param apt_specs: <list> of fitted <AptSpec>
+    :param order: <list> of spec keys, in column order
+    :param raw_data: <dict> test data as returned by the readers
+    :param log: <Logger>
+    :param file: <str> output *.xlsx path
+    :param constant_memory: <bool> stream every worksheet to disk row by row so peak memory doesn't
+                            grow with the test duration
+    """
+    if os.path.dirname(file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+    wb = xlsxwriter.Workbook(file, {'nan_inf_to_errors': True, 'constant_memory': constant_memory})
 
     # create summary page formatting
-    wb = write_summary_formatting(wb, order, log)
+    with timing.stage('write/summary'):
+        wb = write_summary_formatting(wb, order, log, constant_memory, [start_sample(spec) for spec in apt_specs])
 
     # create spec pages
-    wb = write_spec_pages(wb, apt_specs, order, log)
+    wb = write_spec_pages(wb, apt_specs, order, log, constant_memory)
 
     # create raw data page
 
     # populate summary page with data.
 
-    wb.close()
+    with timing.stage('write/close'):
+        wb.close()
+
 
+def start_sample(spec):
+    """
+    :param spec: <AptSpec>
+    :return: <int> data row of the file the spec's (trimmed / segmented) data window starts at
+    """
+    return spec.first_row + spec.window.indices(len(spec._datetime))[0]
 
-def write_summary_formatting(wb, order, log):
+
+def write_summary_formatting(wb, order, log, constant_memory=False, start_samples=None):
+    """
+    :param start_samples: <list> of <int> first data row of every spec's window, see start_sample(); the
+                          summary shows the one row, or their range when the windows start apart
+    """
     # create summary worksheet
-    ws = wb.add_worksheet(name='summary')
+    ws = RowWriter(wb.add_worksheet(name='summary'), constant_memory)
 
     # set column widths
     ws.set_column('A:A', 5)
@@ -106,7 +210,12 @@ def write_summary_formatting(wb, order, log):
 
         # starting sample number label and format
         ws.write('G3', u'Starting Sample #', normal_label_format_11)
-        ws.merge_range('H3:I3', '', yellow_val_format_12)
+        starts = sorted(set(start_samples or ()))
+        if len(starts) > 1:
+            first = '{}-{}'.format(starts[0], starts[-1])
+        else:
+            first = starts[0] if starts else ''
+        ws.merge_range('H3:I3', first, yellow_val_format_12)
 
         # start date & start time
         ws.write('E3', '', yellow_val_format_12)
@@ -214,11 +323,37 @@ def write_summary_formatting(wb, order, log):
 
     format_header()
     format_spec_rows()
+    ws.flush()
 
     return wb
 
 
-def write_spec_pages(wb, specs, order, log):
+def render_spec_page(spec):
+    """
+    Computes everything a spec page shows, ahead of serializing it into the workbook.
+
+    :param spec: <AptSpec>
+    :return: <dict> page buffer: name, start_datetime, start_sample, popt, perr & the data columns (incl.
+             the 95% confidence band) as <ndarray>
+    """
+    fit = spec.fit
+    lower, upper = spec.exp_confidence_bands()
+    return {
+        'name': spec.name,
+        'start_datetime': spec.start_datetime,
+        'start_sample': start_sample(spec),
+        'popt': fit.popt,
+        'perr': fit.perr,
+        'time': spec.time,
+        'pressure': spec.pressure,
+        'psi': np.asarray(spec.psi),
+        'avg_temp': spec.avg_temp,
+        'lower_ci': lower,
+        'upper_ci': upper
+    }
+
+
+def write_spec_pages(wb, specs, order, log, constant_memory=False):
     spec_name = wb.add_format({
         'bold': 1,
         'border': 1,
@@ -363,6 +498,11 @@ def write_spec_pages(wb, specs, order, log):
     date_format = wb.add_format({
         'num_format': 'm/d/yyyy hh:mm:ss AM/PM'
     })
+    eq_a = wb.add_format({'color': 'red', 'bold': True, 'font_size': 18})
+    eq_e = wb.add_format({'color': 'black', 'bold': True, 'font_size': 18})
+    eq_super_b = wb.add_format({'color': 'blue', 'bold': True, 'font_size': 18, 'font_script': 1})
+    eq_super_other = wb.add_format({'color': 'black', 'bold': True, 'font_size': 18, 'font_script': 1})
+    eq_c = wb.add_format({'color': 'green', 'bold': True, 'font_size': 18})
 
     def format_header(sheet, s):
         # set column widths
@@ -373,7 +513,7 @@ def write_spec_pages(wb, specs, order, log):
             sheet.set_row(row, 25)
 
         # write spec name
-        sheet.merge_range('A1:H1', s.name, spec_name)
+        sheet.merge_range('A1:H1', s['name'], spec_name)
 
         # write main header labels
         sheet.merge_range('A2:B2', 'Test Start', labels_drk_14)
@@ -387,18 +527,12 @@ def write_spec_pages(wb, specs, order, log):
         sheet.write('C2', 'Date:', start_labels)
         sheet.write('F2', 'Sample #:', start_labels)
 
-        log.info("starting datetime: {}".format(s.datetime[0]))
+        log.info("starting datetime: {}".format(s['start_datetime']))
 
-        sheet.merge_range('D2:E2', s.datetime[0], date_format)
-        sheet.merge_range('G2:H2', '', normal_12)
+        sheet.merge_range('D2:E2', s['start_datetime'], date_format)
+        sheet.merge_range('G2:H2', s['start_sample'], normal_12)
 
         # write equation
-        eq_a = wb.add_format({'color': 'red', 'bold': True, 'font_size': 18})
-        eq_e = wb.add_format({'color': 'black', 'bold': True, 'font_size': 18})
-        eq_super_b = wb.add_format({'color': 'blue', 'bold': True, 'font_size': 18, 'font_script': 1})
-        eq_super_other = wb.add_format({'color': 'black', 'bold': True, 'font_size': 18, 'font_script': 1})
-        eq_c = wb.add_format({'color': 'green', 'bold': True, 'font_size': 18})
-
         sheet.merge_range('C3:H3', '', eq_label)
         sheet.write_rich_string(
             'C3',
@@ -440,42 +574,56 @@ def write_spec_pages(wb, specs, order, log):
         return sheet
 
     def write_data(sheet, s):
-        cf = s.curve_fit()
-        popt = cf['popt']
-        pcov = cf['pcov']
-        pressure = s.pressure
-        avg_temp = s.avg_temp
-        m_pressure = s.psi
-
-        for i in range(len(s.time)):
-            # write coefficients
-            row = str(i+2)
-            sheet.write('D4', popt[0], data_format)
-            sheet.write('F4', popt[1], data_format)
-            sheet.write('H4', popt[2], data_format)
-
-            sheet.write('D5', pcov[0][0], data_format)
-            sheet.write('F5', pcov[1][1], data_format)
-            sheet.write('H5', pcov[2][2], data_format)
-
-            # write time data in hours
-            sheet.write('I'+row, s.time[i], data_format)
-
-            # write curve fit EQ
-            sheet.write_formula('J'+row, '=D4*EXP(-F4*I'+row+')+H4', data_format)
-
-            # # write normalized pressure
-            # sheet.write_formula('K'+row, '=L'+row+'* E6/M'+row+'', data_format)
-
-            # write normalized pressure
-            sheet.write('K'+row, pressure[i], data_format)
-
-            # write measured pressure
-            sheet.write('L'+row, m_pressure[i], data_format)
-
-
-            # write average temperature
-            sheet.write('M'+row, avg_temp[i], data_format)
+        popt = s['popt']
+        perr = s['perr']
+        first = DATA_ROW + 1
+
+        # write coefficients
+        sheet.write('D4', popt[0], data_format)
+        sheet.write('F4', popt[1], data_format)
+        sheet.write('H4', popt[2], data_format)
+
+        sheet.write('D5', perr[0], data_format)
+        sheet.write('F5', perr[1], data_format)
+        sheet.write('H5', perr[2], data_format)
+
+        if constant_memory:
+            # stream the data rows: time, curve fit EQ, normalized pressure, measured pressure, avg. temp,
+            # lower & upper confidence int.
+            for i in range(len(s['time'])):
+                sheet.write_row(DATA_ROW + i, ALPHA['I'], (
+                    s['time'][i],
+                    '=D4*EXP(-F4*I{0})+H4'.format(first + i),
+                    s['pressure'][i],
+                    s['psi'][i],
+                    s['avg_temp'][i],
+                    s['lower_ci'][i],
+                    s['upper_ci'][i]
+                ), data_format)
+            sheet.flush()
+            return sheet
+
+        sheet.flush()
+
+        # write time data in hours
+        sheet.write_column(DATA_ROW, ALPHA['I'], s['time'].tolist(), data_format)
+
+        # write curve fit EQ, one formula per row as in constant_memory mode, so every cell stays editable
+        for i in range(len(s['time'])):
+            sheet.write_formula(DATA_ROW + i, ALPHA['J'], '=D4*EXP(-F4*I{0})+H4'.format(first + i), data_format)
+
+        # write normalized pressure
+        sheet.write_column(DATA_ROW, ALPHA['K'], s['pressure'].tolist(), data_format)
+
+        # write measured pressure
+        sheet.write_column(DATA_ROW, ALPHA['L'], s['psi'].tolist(), data_format)
+
+        # write average temperature
+        sheet.write_column(DATA_ROW, ALPHA['M'], s['avg_temp'].tolist(), data_format)
+
+        # write 95% confidence interval of the curve fit
+        sheet.write_column(DATA_ROW, ALPHA['N'], s['lower_ci'].tolist(), data_format)
+        sheet.write_column(DATA_ROW, ALPHA['O'], s['upper_ci'].tolist(), data_format)
 
         return sheet
 
@@ -483,13 +631,13 @@ def write_spec_pages(wb, specs, order, log):
         chart = wb.add_chart({'type': 'line'})
         chart.add_series({
             'name': 'Curve Fit',
-            'categories': '='+s.name+'!$I$3:$I$'+str(len(s.psi)+3),
-            'values': '='+s.name+'!$J$3:$J$'+str(len(s.psi)+3)
+            'categories': '='+s['name']+'!$I$3:$I$'+str(len(s['psi']) + DATA_ROW),
+            'values': '='+s['name']+'!$J$3:$J$'+str(len(s['psi']) + DATA_ROW)
         })
         chart.add_series({
             'name': 'Pressure',
-            'categories': '=' + s.name + '!$I$3:$I$' + str(len(s.psi) + 3),
-            'values': '=' + s.name + '!$K$3:$K$' + str(len(s.psi) + 3)
+            'categories': '=' + s['name'] + '!$I$3:$I$' + str(len(s['psi']) + DATA_ROW),
+            'values': '=' + s['name'] + '!$K$3:$K$' + str(len(s['psi']) + DATA_ROW)
         })
         chart.set_title({'name': 'Pressure vs. Time'})
         chart.set_x_axis({'name': 'Time (hours)', 'interval_unit': 86, 'major_tick': 43, 'minor_tick': 21})
@@ -500,9 +648,11 @@ def write_spec_pages(wb, specs, order, log):
 
         return sheet
 
-    for i, spec in enumerate(specs):
-        ws = format_header(wb.add_worksheet(name=spec.name), s=spec)
-        ws = write_data(ws, spec)
-        ws = write_charts(ws, spec)
+    for spec in specs:
+        with timing.stage('write/sheet/' + spec.name):
+            page = render_spec_page(spec)
+            ws = format_header(RowWriter(wb.add_worksheet(name=page['name']), constant_memory), s=page)
+            ws = write_data(ws, page)
+            ws = write_charts(ws, page)
 
     return wb
@@ -0,0 +1,41 @@
+import os
+import sys
+import logging
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# relative imports
+from src import read_csv as rc
+from src import outliers as ol
+from src import AptSpec as apt
+
+RAW_DATA = os.path.join(ROOT, 'bgAPT', 'raw_data.csv')
+
+
+def clean_specs(file, rule):
+    data, order = rc.read_csv(file=file, start=0, log=logging.getLogger('status'))
+    specs = [apt.AptSpec(key, **data[key]) for key in order]
+    for spec in specs:
+        spec.set_outlier_rule(rule)
+    ol.detect_specs(specs)
+    return {spec.name: spec for spec in specs}
+
+
+def test_first_sample_glitch_is_rejected():
+    # the 20.140 PSI reading of P40 is the very first row of the export
+    specs = clean_specs(RAW_DATA, ol.OutlierRule())
+    p40 = specs['p40']
+    assert p40.psi[0] == 20.140
+    assert p40.rejected[0]
+    assert 0 in [row['sample'] for row in ol.report(p40)]
+
+
+def test_edge_spikes_are_rejected():
+    t = np.linspace(0, 100, 500)
+    p = 30 * np.exp(-t / 50) + np.random.default_rng(0).normal(0, 0.01, t.size)
+    p[[0, 250, 499]] += 3
+    rejected, median, threshold = ol.OutlierRule().detect(p)
+    assert np.flatnonzero(rejected[0]).tolist() == [0, 250, 499]